@@ -1,4 +1,5 @@
 import streamlit as st
+from warmup import start_warmup
 
 # Настройка страницы
 st.set_page_config(
@@ -7,6 +8,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Фоновый импорт тяжёлых библиотек, пока пользователь читает описание
+start_warmup()
+
 # Главный заголовок
 st.title("🧬 Differential Gene Expression Analysis")
 st.markdown("---")
@@ -32,7 +36,7 @@ st.markdown("""
 ## 🔍 Основные возможности
 
 ### 📊 Загрузка данных
-- Поддержка форматов GEO (Series Matrix, SOFT)
+- Поддержка форматов GEO (Series Matrix, SOFT family `.soft.gz` с потоковой загрузкой)
 - Автоматическое извлечение метаданных
 - Нормализация сырых данных
 
@@ -45,6 +49,7 @@ st.markdown("""
 - Heatmaps экспрессии генов
 - Volcano plots
 - PCA plots для оценки группировки образцов
+- Экспорт таблиц (CSV, Parquet, XLSX) и графиков (PNG, SVG) одним архивом
 """)
 
 st.markdown("---")
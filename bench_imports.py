@@ -0,0 +1,64 @@
+"""
+Замер холодной загрузки страниц
+
+Каждая страница запускается через streamlit.testing.v1.AppTest в отдельном
+интерпретаторе, поэтому все импорты выполняются с нуля. Фоновый прогрев
+отключается (DGE_NO_WARMUP=1), чтобы мерить саму страницу. Для сравнения
+запустите скрипт на двух ревизиях:
+
+    python bench_imports.py --repeat 5 > bench_output.txt
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PAGES = (
+    'Main.py',
+    'pages/1_Load_files.py',
+    'pages/2_Differential_expression_analysis.py',
+    'pages/3_Enrichment.py',
+    'pages/4_Export.py',
+)
+HEAVY_MODULES = ('scipy', 'matplotlib', 'seaborn', 'plotly', 'networkx')
+
+CHILD_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in sys.argv[2:] if m in sys.modules)
+print(json.dumps({'seconds': elapsed, 'heavy': heavy, 'failed': len(app.exception) > 0}))
+"""
+
+
+def measure(page: str) -> dict:
+    env = dict(os.environ, DGE_NO_WARMUP='1')
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, os.path.abspath(page), *HEAVY_MODULES],
+        capture_output=True, text=True, check=True, env=env
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('pages', nargs='*', default=PAGES)
+    args = parser.parse_args()
+
+    print(f"{'page':<48} {'median, ms':>10}  heavy modules loaded")
+    for page in args.pages:
+        runs = [measure(page) for _ in range(args.repeat)]
+        median = statistics.median(run['seconds'] for run in runs) * 1000
+        heavy = ', '.join(runs[-1]['heavy']) or '-'
+        # Страница, упавшая с исключением, загружается быстрее, но замер недействителен
+        failed = '  (page raised an exception)' if runs[-1]['failed'] else ''
+        print(f"{page:<48} {median:>10.0f}  {heavy}{failed}")
+
+
+if __name__ == '__main__':
+    main()
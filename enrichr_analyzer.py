@@ -1,16 +1,15 @@
 import json
 import requests
 import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import streamlit as st
 import numpy as np
 
 
 class EnrichrAnalyzer:
     """
-    Расширенный класс для анализа обогащения генов с визуализацией сети
+    Клиент Enrichr для анализа обогащения генов
+
+    Визуализация сети вынесена в plots.plot_enrichment_network, чтобы клиент
+    не тянул networkx и matplotlib.
     """
 
     BASE_URL = 'http://amp.pharm.mssm.edu/Enrichr/'
@@ -39,6 +38,22 @@ class EnrichrAnalyzer:
                 f'Error getting enrichment results: {response.status_code}')
         return json.loads(response.text)
 
+    def get_gene_set_library(self, library: str) -> dict:
+        """Скачивает библиотеку наборов генов Enrichr: термин → список генов"""
+        query = f'geneSetLibrary?mode=text&libraryName={library}'
+        response = requests.get(self.BASE_URL + query)
+        if not response.ok:
+            raise Exception(
+                f'Error getting gene set library: {response.status_code}')
+
+        gene_sets = {}
+        for line in response.text.splitlines():
+            fields = line.split('\t')
+            if len(fields) > 2:
+                # Гены могут идти с весом через запятую: "TP53,1.0"
+                gene_sets[fields[0]] = [gene.split(',')[0] for gene in fields[2:] if gene]
+        return gene_sets
+
     def enrich(self, gene_list: list, description: str, library: str,
                top_terms: int = 20) -> pd.DataFrame:
         """
@@ -74,86 +89,3 @@ class EnrichrAnalyzer:
         df = pd.DataFrame(records)
         df['-log10(P-value)'] = -np.log10(df['P-value'])
         return df.sort_values('P-value')
-
-    def plot_enrichment_network(self, df: pd.DataFrame, figsize=(10, 10)):
-        """
-        Строит сеть обогащения и отображает в Streamlit
-
-        Args:
-            df: DataFrame с результатами обогащения
-            figsize: размер фигуры
-        """
-        G = nx.Graph()
-
-        # Добавляем узлы для терминов и генов
-        for _, row in df.iterrows():
-            term = row['Term']
-            G.add_node(term, type='term', pvalue=row['P-value'])
-
-            for gene in row['Genes']:
-                G.add_node(gene, type='gene')
-                G.add_edge(term, gene)
-
-        # Раскраска узлов
-        term_nodes = [n for n, attrs in G.nodes(
-            data=True) if attrs['type'] == 'term']
-        gene_nodes = [n for n, attrs in G.nodes(
-            data=True) if attrs['type'] == 'gene']
-
-        # Позиционирование узлов
-        pos = nx.spring_layout(G, k=0.3, iterations=50)
-
-        # Создаем фигуру
-        fig, ax = plt.subplots(figsize=figsize)
-
-        # Рисуем термины (круги)
-        nx.draw_networkx_nodes(
-            G, pos,
-            nodelist=term_nodes,
-            node_color=[G.nodes[n]['pvalue'] for n in term_nodes],
-            node_size=800,
-            cmap=plt.cm.Reds,
-            alpha=0.8,
-            node_shape="s"
-        )
-
-        # Рисуем гены (квадраты)
-        nx.draw_networkx_nodes(
-            G, pos,
-            nodelist=gene_nodes,
-            node_color='skyblue',
-            node_size=400,
-            alpha=0.8,
-            node_shape="o"
-        )
-
-        # Рисуем ребра
-        nx.draw_networkx_edges(G, pos, width=1.0, alpha=0.2)
-
-        # Подписи узлов
-        nx.draw_networkx_labels(
-            G, pos,
-            labels={n: n for n in G.nodes()},
-            font_size=8,
-            font_family='sans-serif'
-        )
-
-        # Легенда и цветовая шкала
-        sm = plt.cm.ScalarMappable(
-            cmap=plt.cm.Reds,
-            norm=plt.Normalize(vmin=df['P-value'].min(), vmax=df['P-value'].max()))
-        sm.set_array([])
-        plt.colorbar(
-            sm,
-            ax=ax,  # Указываем конкретный Axes
-            label='P-value',
-            shrink=0.5,
-            location='right'
-        )
-
-        plt.title("Enrichment Network", fontsize=12)
-        plt.axis('off')
-
-        # Отображаем в Streamlit
-        st.pyplot(plt.gcf())
-        plt.clf()
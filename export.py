@@ -0,0 +1,205 @@
+import io
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import Future
+import pandas as pd
+from expression_store import DEFAULT_CHUNK_ROWS, ExpressionView
+
+TABLE_FORMATS = ('csv', 'parquet', 'xlsx')
+FIGURE_FORMATS = ('png', 'svg')
+# Ограничения листа Excel (одна строка уходит на заголовок)
+XLSX_MAX_ROWS = 1_048_575
+XLSX_MAX_COLUMNS = 16_384
+# Таблицы больше этого числа ячеек в XLSX не пишутся: openpyxl пишет ~100 тыс. ячеек/с
+XLSX_MAX_CELLS = 2_000_000
+
+
+def _iter_chunks(table, chunk_rows: int):
+    """Блоки строк таблицы: DataFrame режется по строкам, ExpressionView читается из memmap"""
+    if isinstance(table, ExpressionView):
+        for start, stop, block in table.iter_row_chunks(chunk_rows):
+            yield pd.DataFrame(block, index=table.index[start:stop], columns=table.columns)
+    else:
+        for start in range(0, len(table), chunk_rows):
+            yield table.iloc[start:start + chunk_rows]
+
+
+def _flatten(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Плоский вид блока: индекс (кроме RangeIndex) — колонка, списки генов — строка через ';'"""
+    if not isinstance(chunk.index, pd.RangeIndex):
+        chunk = chunk.reset_index()
+    else:
+        chunk = chunk.reset_index(drop=True)
+    for col in chunk.columns:
+        if chunk[col].dtype == object and chunk[col].map(lambda v: isinstance(v, list)).any():
+            chunk[col] = chunk[col].map(lambda v: ';'.join(map(str, v)) if isinstance(v, list) else v)
+    chunk.columns = chunk.columns.astype(str)
+    return chunk
+
+
+def _write_csv(bundle: zipfile.ZipFile, arcname: str, table, chunk_rows: int):
+    with bundle.open(arcname, 'w', force_zip64=True) as raw, \
+            io.TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+        header = True
+        for chunk in _iter_chunks(table, chunk_rows):
+            _flatten(chunk).to_csv(f, header=header, index=False)
+            header = False
+        if header:
+            pd.DataFrame(columns=table.columns).to_csv(f, index=False)
+
+
+def _write_parquet(path: str, table, chunk_rows: int):
+    """Пишет таблицу в Parquet по одной группе строк на блок"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in _iter_chunks(table, chunk_rows):
+            batch = pa.Table.from_pandas(_flatten(chunk), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema)
+            else:
+                batch = batch.cast(writer.schema)
+            writer.write_table(batch)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(
+                pd.DataFrame(columns=table.columns.astype(str)), preserve_index=False), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _sheet_title(name: str, used: set) -> str:
+    """Имя листа Excel: без запрещённых символов, не длиннее 31 символа, уникальное"""
+    base = re.sub(r'[\[\]:*?/\\]', '_', name)[:31] or 'Sheet'
+    title, i = base, 1
+    while title.lower() in used:
+        suffix = f"_{i}"
+        title, i = base[:31 - len(suffix)] + suffix, i + 1
+    used.add(title.lower())
+    return title
+
+
+def _write_xlsx(path: str, tables: dict, chunk_rows: int) -> list:
+    """
+    Пишет таблицы в одну книгу openpyxl в режиме write_only (строки не держатся в памяти)
+
+    Returns:
+        имена таблиц, пропущенных из-за размера
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    used, skipped = set(), []
+    for name, table in tables.items():
+        rows, columns = table.shape
+        if rows > XLSX_MAX_ROWS or columns + 1 > XLSX_MAX_COLUMNS or rows * columns > XLSX_MAX_CELLS:
+            skipped.append(name)
+            continue
+        sheet = workbook.create_sheet(_sheet_title(name, used))
+        for i, chunk in enumerate(_iter_chunks(table, chunk_rows)):
+            chunk = _flatten(chunk)
+            if i == 0:
+                sheet.append(chunk.columns.tolist())
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False, name=None):
+                sheet.append(row)
+    if not workbook.worksheets:
+        workbook.create_sheet('empty')
+    workbook.save(path)
+    return skipped
+
+
+def render_figure(builder: str, args: tuple, kwargs: dict, formats=FIGURE_FORMATS) -> dict:
+    """
+    Строит фигуру функцией plots.<builder> и возвращает байты в каждом формате
+
+    Функция уровня модуля, чтобы выполняться в пуле процессов.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import plots
+
+    fig = getattr(plots, builder)(*args, **kwargs)
+    rendered = {}
+    for fmt in formats:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, bbox_inches='tight', dpi=150)
+        rendered[fmt] = buffer.getvalue()
+    plt.close(fig)
+    return rendered
+
+
+def _submit(executor, fn, *args) -> Future:
+    """Отправляет fn в executor; без него выполняет сразу и возвращает готовый Future"""
+    if executor is not None:
+        return executor.submit(fn, *args)
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def write_bundle(path: str, tables: dict, figures: dict = None,
+                 table_formats=TABLE_FORMATS, figure_formats=FIGURE_FORMATS,
+                 executor=None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> list:
+    """
+    Собирает таблицы и фигуры в один zip архив
+
+    Таблицы (DataFrame или ExpressionView) пишутся блоками строк: CSV —
+    напрямую в запись архива, Parquet — во временный файл, который затем
+    копируется в архив. XLSX (самый медленный формат) и фигуры строятся
+    параллельно в executor (например, пуле процессов планировщика), пока
+    пишутся CSV и Parquet. Parquet пишется, только если установлен pyarrow.
+
+    Args:
+        tables: словарь имя → таблица; имя становится путём внутри архива
+        figures: словарь имя → (имя функции из plots, args, kwargs)
+
+    Returns:
+        список записанных файлов архива
+    """
+    figures = figures or {}
+    written, notes = [], []
+    if 'parquet' in table_formats:
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            notes.append("Parquet skipped: pyarrow is not installed")
+            table_formats = [fmt for fmt in table_formats if fmt != 'parquet']
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp, \
+            zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as bundle:
+        xlsx_path = os.path.join(tmp, 'tables.xlsx')
+        xlsx = _submit(executor, _write_xlsx, xlsx_path, tables, chunk_rows) \
+            if 'xlsx' in table_formats and tables else None
+        rendered = {name: _submit(executor, render_figure, builder, args, kwargs, figure_formats)
+                    for name, (builder, args, kwargs) in figures.items()}
+
+        for name, table in tables.items():
+            if 'csv' in table_formats:
+                _write_csv(bundle, f"csv/{name}.csv", table, chunk_rows)
+                written.append(f"csv/{name}.csv")
+            if 'parquet' in table_formats:
+                tmp_path = os.path.join(tmp, 'table.parquet')
+                _write_parquet(tmp_path, table, chunk_rows)
+                bundle.write(tmp_path, f"parquet/{name}.parquet")
+                os.remove(tmp_path)
+                written.append(f"parquet/{name}.parquet")
+
+        if xlsx is not None:
+            skipped = xlsx.result()
+            bundle.write(xlsx_path, 'tables.xlsx')
+            written.append('tables.xlsx')
+            notes.extend(f"XLSX skipped {name}: too large for a worksheet" for name in skipped)
+
+        for name, future in rendered.items():
+            for fmt, data in future.result().items():
+                bundle.writestr(f"figures/{name}.{fmt}", data)
+                written.append(f"figures/{name}.{fmt}")
+
+        bundle.writestr('README.txt', '\n'.join(written + [''] + notes) + '\n')
+    return written
@@ -0,0 +1,276 @@
+import os
+import hashlib
+import uuid
+import numpy as np
+import pandas as pd
+from gene_ids import GeneIndex
+
+DEFAULT_CHUNK_ROWS = 10000
+# Память (байт) под блок столбцов: хранилище построчное, поэтому каждое
+# чтение блока столбцов проходит по всему файлу и блоки должны быть крупными
+MEMORY_BUDGET = 1 << 30
+
+
+def columns_per_block(n_rows: int, itemsize: int, budget: int = MEMORY_BUDGET) -> int:
+    """Сколько столбцов по n_rows значений размера itemsize помещается в budget байт"""
+    return max(1, int(budget // max(1, n_rows * itemsize)))
+
+
+def _write_labels(path: str, labels):
+    with open(path, 'w') as f:
+        f.writelines(f"{label}\n" for label in labels)
+
+
+def _read_labels(path: str, name=None) -> pd.Index:
+    with open(path, 'r') as f:
+        return pd.Index([line.rstrip('\n') for line in f], name=name)
+
+
+def staging_name(name: str) -> str:
+    """Уникальное имя, под которым хранилище собирается до публикации"""
+    return f"{name}.staging-{uuid.uuid4().hex[:8]}"
+
+
+class ExpressionStore:
+    """
+    Матрица экспрессии (гены × образцы) на диске
+
+    Значения хранятся в float32 .npy файле и открываются через memmap,
+    поэтому несколько сессий читают одни и те же страницы из page cache ОС.
+    Индексы генов и образцов хранятся в отдельных текстовых файлах.
+
+    Новое хранилище собирается под временным именем (staging_name) и
+    публикуется переименованием (publish); опубликованное хранилище только
+    читается, поэтому его можно держать открытым в других сессиях и процессах.
+    """
+
+    def __init__(self, directory: str, name: str, mode: str = 'r'):
+        self.directory = directory
+        self.name = name
+        values_path, genes_path, samples_path = self.paths(directory, name)
+        self.values = np.load(values_path, mmap_mode=mode)
+        self.genes = _read_labels(genes_path, name='id')
+        self.samples = _read_labels(samples_path)
+        self.gene_ids = None
+
+    def __getstate__(self):
+        # В другой процесс передаётся путь, а не данные: memmap открывается
+        # заново только на чтение и разделяет страницы с остальными процессами
+        state = self.__dict__.copy()
+        del state['values']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.values = np.load(self.paths(self.directory, self.name)[0], mmap_mode='r')
+
+    @staticmethod
+    def paths(directory: str, name: str) -> tuple:
+        """Пути к файлам значений, генов и образцов"""
+        base = os.path.join(directory, name)
+        return f"{base}_values.npy", f"{base}_genes.txt", f"{base}_samples.txt"
+
+    @classmethod
+    def exists(cls, directory: str, name: str) -> bool:
+        return all(os.path.exists(path) for path in cls.paths(directory, name))
+
+    @classmethod
+    def publish(cls, directory: str, staging: str, name: str) -> 'ExpressionStore':
+        """
+        Переименовывает собранное хранилище staging в name и открывает его на чтение
+
+        Файлы меток переименовываются после файла значений, поэтому exists(name)
+        становится истинным только для полностью записанного хранилища.
+        """
+        for source, target in zip(cls.paths(directory, staging), cls.paths(directory, name)):
+            os.replace(source, target)
+        return cls(directory, name)
+
+    @classmethod
+    def discard(cls, directory: str, name: str):
+        """Удаляет файлы хранилища (например, недособранного staging)"""
+        for path in cls.paths(directory, name):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def create(cls, directory: str, name: str, genes, samples) -> 'ExpressionStore':
+        """
+        Создаёт пустое хранилище (заполненное NaN), открытое на запись
+
+        name должен быть staging-именем: файлы создаются заново (w+).
+        """
+        values_path, genes_path, samples_path = cls.paths(directory, name)
+        values = np.lib.format.open_memmap(
+            values_path, mode='w+', dtype=np.float32, shape=(len(genes), len(samples)))
+        for start in range(0, len(genes), DEFAULT_CHUNK_ROWS):
+            values[start:start + DEFAULT_CHUNK_ROWS] = np.nan
+        values.flush()
+        del values
+
+        _write_labels(genes_path, genes)
+        _write_labels(samples_path, samples)
+        return cls(directory, name, mode='r+')
+
+    @classmethod
+    def from_csv(cls, csv_path: str, directory: str, name: str,
+                 chunksize: int = 5000) -> 'ExpressionStore':
+        """
+        Переписывает CSV матрицу экспрессии в хранилище по частям строк
+
+        Целиком CSV в память не загружается: одновременно читается не более
+        chunksize строк. Хранилище собирается под staging-именем и
+        публикуется после записи; возвращается открытым на чтение.
+        """
+        samples = pd.read_csv(csv_path, index_col=0, nrows=0).columns
+        with open(csv_path, 'r') as f:
+            n_genes = sum(1 for _ in f) - 1
+
+        staging = staging_name(name)
+        values_path, genes_path, samples_path = cls.paths(directory, staging)
+        try:
+            values = np.lib.format.open_memmap(
+                values_path, mode='w+', dtype=np.float32, shape=(n_genes, len(samples)))
+            genes = []
+            start = 0
+            for chunk in pd.read_csv(csv_path, index_col=0, chunksize=chunksize):
+                stop = start + len(chunk)
+                values[start:stop] = chunk.to_numpy(dtype=np.float32)
+                genes.extend(chunk.index.astype(str))
+                start = stop
+            values.flush()
+            del values
+            if start != n_genes:
+                raise ValueError(f"{csv_path}: read {start} rows, expected {n_genes}")
+
+            _write_labels(genes_path, genes)
+            _write_labels(samples_path, samples)
+        except BaseException:
+            cls.discard(directory, staging)
+            raise
+        return cls.publish(directory, staging, name)
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def copy_to(self, directory: str, name: str, columns=None) -> 'ExpressionStore':
+        """
+        Копирует хранилище (или выбранные позиции образцов) блоками строк
+
+        Копия открыта на запись; name должен быть staging-именем (см. publish).
+        """
+        view = ExpressionView(self, columns=columns)
+        target = ExpressionStore.create(directory, name, view.index, view.columns)
+        for start, stop, block in view.iter_row_chunks():
+            target.values[start:stop] = block
+        target.values.flush()
+        return target
+
+    def view(self) -> 'ExpressionView':
+        """Представление всей матрицы"""
+        return ExpressionView(self)
+
+
+class ExpressionView:
+    """
+    Подмножество генов и образцов хранилища без копирования данных
+
+    Фильтрация и выбор образцов только меняют массивы позиций; значения
+    читаются из memmap блоками строк при вычислениях.
+    """
+
+    def __init__(self, store: ExpressionStore, rows=None, columns=None):
+        self.store = store
+        n_genes, n_samples = store.shape
+        self.rows = np.arange(n_genes) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.cols = np.arange(n_samples) if columns is None else np.asarray(columns, dtype=np.int64)
+
+    @property
+    def index(self) -> pd.Index:
+        return self.store.genes[self.rows]
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.store.samples[self.cols]
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.rows), len(self.cols)
+
+    @property
+    def empty(self) -> bool:
+        return not len(self.rows) or not len(self.cols)
+
+    def fingerprint(self) -> str:
+        """Идентификатор содержимого представления (хранилище, гены, образцы)"""
+        digest = hashlib.sha1(f"{self.store.directory}/{self.store.name}".encode())
+        digest.update(self.rows.tobytes())
+        digest.update(self.cols.tobytes())
+        return digest.hexdigest()
+
+    def filter_genes(self, gene_list, gene_index: GeneIndex = None) -> 'ExpressionView':
+        """
+        Оставляет гены из списка, сохраняя порядок хранилища
+
+        Если передан gene_index и гены хранилища интернированы, сравнение идёт
+        по id, поэтому синонимы, регистр и Entrez/Ensembl id тоже совпадают.
+        """
+        if gene_index is None or self.store.gene_ids is None:
+            mask = self.index.isin(gene_list)
+        else:
+            mask = gene_index.isin(self.store.gene_ids[self.rows],
+                                   gene_index.lookup(gene_list))
+        return ExpressionView(self.store, self.rows[mask], self.cols)
+
+    def select_genes(self, genes) -> 'ExpressionView':
+        """Выбирает гены в заданном порядке; отсутствующие пропускаются"""
+        positions = self.index.get_indexer(genes)
+        return ExpressionView(self.store, self.rows[positions[positions >= 0]], self.cols)
+
+    def select_samples(self, samples) -> 'ExpressionView':
+        """Выбирает образцы в заданном порядке"""
+        positions = self.columns.get_indexer(samples)
+        if (positions < 0).any():
+            raise KeyError(f"Samples not found: {list(pd.Index(samples)[positions < 0])}")
+        return ExpressionView(self.store, self.rows, self.cols[positions])
+
+    def iter_row_chunks(self, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        """Итерирует по блокам строк: (start, stop, float32 массив блока)"""
+        full_columns = len(self.cols) == self.store.shape[1] and \
+            np.array_equal(self.cols, np.arange(len(self.cols)))
+        for start in range(0, len(self.rows), chunk_rows):
+            stop = min(start + chunk_rows, len(self.rows))
+            block = self.store.values[self.rows[start:stop]]
+            if not full_columns:
+                block = block[:, self.cols]
+            yield start, stop, np.asarray(block, dtype=np.float32)
+
+    def column_block(self, start: int, stop: int,
+                     chunk_rows: int = DEFAULT_CHUNK_ROWS) -> np.ndarray:
+        """Читает столбцы [start, stop) по всем генам представления"""
+        cols = self.cols[start:stop]
+        block = np.empty((len(self.rows), len(cols)), dtype=np.float32)
+        for row_start in range(0, len(self.rows), chunk_rows):
+            rows = self.rows[row_start:row_start + chunk_rows]
+            block[row_start:row_start + len(rows)] = self.store.values[rows][:, cols]
+        return block
+
+    def row_means(self, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> pd.Series:
+        """Среднее по образцам для каждого гена (NaN пропускаются)"""
+        means = np.empty(len(self.rows), dtype=np.float64)
+        for start, stop, block in self.iter_row_chunks(chunk_rows):
+            valid = ~np.isnan(block)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[start:stop] = np.where(valid, block, 0).sum(
+                    axis=1, dtype=np.float64) / valid.sum(axis=1)
+        return pd.Series(means, index=self.index)
+
+    def to_frame(self, max_rows: int = None) -> pd.DataFrame:
+        """Загружает представление (или его первые max_rows генов) в DataFrame"""
+        view = self if max_rows is None else ExpressionView(
+            self.store, self.rows[:max_rows], self.cols)
+        values = np.concatenate(
+            [block for _, _, block in view.iter_row_chunks()]) if len(view.rows) else \
+            np.empty((0, len(view.cols)), dtype=np.float32)
+        return pd.DataFrame(values, index=view.index, columns=view.columns)
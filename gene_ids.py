@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# Колонки HGNC complete set в порядке приоритета при неоднозначных синонимах
+ALIAS_COLUMNS = ('symbol', 'prev_symbol', 'alias_symbol', 'entrez_id', 'ensembl_gene_id')
+MISSING_ID = -1
+
+
+def normalize_labels(labels) -> pd.Index:
+    """Приводит идентификаторы генов к ключу поиска: верхний регистр, без версии Ensembl"""
+    keys = pd.Index(labels, dtype=object).astype(str).str.strip().str.upper()
+    return keys.str.replace(r'^(ENS[A-Z]*G\d+)\.\d+$', r'\1', regex=True)
+
+
+class GeneIndex:
+    """
+    Вселенная генов: символы интернируются в int32 id
+
+    id гена — позиция канонического символа в self.symbols. Символы, синонимы,
+    прежние символы, Entrez и Ensembl id хранятся в одном хеш-индексе ключей,
+    поэтому поиск списка генов — одна векторная операция get_indexer.
+    """
+
+    def __init__(self, symbols, keys, key_ids):
+        self.symbols = np.asarray(symbols, dtype=object)
+        self._keys = pd.Index(keys)
+        self._key_ids = np.asarray(key_ids, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @classmethod
+    def from_symbols(cls, symbols) -> 'GeneIndex':
+        """Вселенная из списка символов без таблицы синонимов"""
+        symbols = pd.Index(symbols, dtype=object).astype(str)
+        keys = normalize_labels(symbols)
+        # Символы, отличающиеся только регистром, считаются одним геном
+        first = ~keys.duplicated()
+        symbols, keys = symbols[first], keys[first]
+        return cls(symbols, keys, np.arange(len(symbols), dtype=np.int32))
+
+    @classmethod
+    def from_alias_table(cls, path: str) -> 'GeneIndex':
+        """
+        Загружает таблицу в формате HGNC complete set (TSV)
+
+        Обязательна колонка symbol; prev_symbol, alias_symbol, entrez_id и
+        ensembl_gene_id необязательны, множественные значения разделены '|'.
+        """
+        table = pd.read_csv(path, sep='\t', dtype=str,
+                            usecols=lambda col: col in ALIAS_COLUMNS)
+        table = table.dropna(subset=['symbol']).drop_duplicates('symbol')
+        ids = np.arange(len(table), dtype=np.int32)
+
+        parts = []
+        for col in ALIAS_COLUMNS:
+            if col not in table:
+                continue
+            values = table[col].set_axis(ids).str.split('|').explode().dropna()
+            parts.append(values)
+        keys = pd.concat(parts)
+        keys = pd.Series(keys.index.to_numpy(dtype=np.int32),
+                         index=normalize_labels(keys.to_numpy()))
+        keys = keys[(keys.index != '') & ~keys.index.duplicated()]
+        return cls(table['symbol'].to_numpy(), keys.index, keys.to_numpy())
+
+    def extend(self, labels) -> 'GeneIndex':
+        """
+        Возвращает новую вселенную, дополненную не найденными идентификаторами
+
+        Исходный индекс не изменяется, поэтому его можно разделять между сессиями.
+        """
+        labels = pd.Index(labels, dtype=object).astype(str)
+        missing = labels[self.lookup(labels) == MISSING_ID].unique()
+        if not len(missing):
+            return self
+        extra = GeneIndex.from_symbols(missing)
+        return GeneIndex(
+            np.concatenate([self.symbols, extra.symbols]),
+            self._keys.append(extra._keys),
+            np.concatenate([self._key_ids, extra._key_ids + len(self)]))
+
+    def lookup(self, labels) -> np.ndarray:
+        """int32 id для каждого идентификатора; MISSING_ID для неизвестных"""
+        positions = self._keys.get_indexer(normalize_labels(labels))
+        ids = np.full(len(positions), MISSING_ID, dtype=np.int32)
+        found = positions >= 0
+        ids[found] = self._key_ids[positions[found]]
+        return ids
+
+    def canonical(self, labels) -> list:
+        """Канонические символы; неизвестные идентификаторы остаются как есть"""
+        labels = pd.Index(labels, dtype=object).astype(str)
+        ids = self.lookup(labels)
+        found = ids != MISSING_ID
+        result = labels.to_numpy(copy=True)
+        result[found] = self.symbols[ids[found]]
+        return result.tolist()
+
+    def isin(self, ids, query_ids) -> np.ndarray:
+        """Булева маска: какие из ids входят в query_ids (через таблицу длины len(self))"""
+        query_ids = np.asarray(query_ids)
+        table = np.zeros(len(self) + 1, dtype=bool)
+        table[query_ids[query_ids != MISSING_ID]] = True
+        # MISSING_ID = -1 попадает в последний (всегда False) элемент таблицы
+        return table[np.asarray(ids)]
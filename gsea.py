@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+from gene_ids import GeneIndex, normalize_labels
+
+# Ограничение на размер батча перестановок (число позиций генов в батче)
+MAX_BATCH_POSITIONS = 4_000_000
+
+
+def rank_genes(de_results: pd.DataFrame, gene_index: GeneIndex = None) -> pd.Series:
+    """
+    Ранжирует все гены таблицы дифф. экспрессии
+
+    Метрика — sign(log2FC) × -log10(p). Если передан gene_index, метки
+    приводятся к каноническим символам; из генов с одинаковым ключом поиска
+    (в том числе отличающихся только регистром) остаётся ген с наибольшим
+    |метрика|.
+    """
+    results = de_results.dropna(subset=['log2_fold_change', 'p_value'])
+    metric = np.sign(results['log2_fold_change'].to_numpy()) * \
+        -np.log10(np.clip(results['p_value'].to_numpy(), 1e-300, 1))
+    genes = results['gene'].astype(str).tolist()
+    if gene_index is not None:
+        genes = gene_index.canonical(genes)
+
+    ranking = pd.Series(metric, index=genes)
+    ranking = ranking.iloc[np.argsort(-np.abs(ranking.to_numpy()), kind='stable')]
+    ranking = ranking[~normalize_labels(ranking.index).duplicated()]
+    return ranking.sort_values(ascending=False)
+
+
+def _set_positions(gene_sets: dict, genes: pd.Index, min_size: int, max_size: int) -> tuple:
+    """
+    Позиции генов наборов в ранжированном списке в CSR-виде
+
+    Гены всех наборов ищутся одним вызовом get_indexer по уникальным меткам,
+    затем пары (набор, позиция) кодируются одним int64, сортируются и
+    дедуплицируются.
+
+    Returns:
+        названия наборов, размеры наборов, плоский массив позиций (int32)
+    """
+    n_genes = len(genes)
+    keys = normalize_labels(genes)
+    # Из генов с одинаковым ключом используется первый (по рангу)
+    first = ~keys.duplicated()
+    key_positions = np.flatnonzero(first)
+    keys = keys[first]
+
+    terms = list(gene_sets)
+    lengths = np.fromiter((len(set_genes) for set_genes in gene_sets.values()),
+                          dtype=np.int64, count=len(terms))
+    labels = [gene for set_genes in gene_sets.values() for gene in set_genes]
+    codes, uniques = pd.factorize(pd.Index(labels, dtype=object))
+    found = keys.get_indexer(normalize_labels(uniques))[codes] if len(labels) else \
+        np.empty(0, dtype=np.int64)
+    term_codes = np.repeat(np.arange(len(terms), dtype=np.int64), lengths)
+
+    hit = found >= 0
+    pairs = np.sort(term_codes[hit] * n_genes + key_positions[found[hit]])
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])] if len(pairs) else pairs
+    term_of, positions = np.divmod(pairs, n_genes)
+
+    set_sizes = np.bincount(term_of, minlength=len(terms))
+    valid = (set_sizes >= max(min_size, 1)) & (set_sizes <= max_size)
+    names = [terms[i] for i in np.flatnonzero(valid)]
+    return names, set_sizes[valid].astype(np.int64), positions[valid[term_of]].astype(np.int32)
+
+
+def _segment_scores(positions: np.ndarray, sizes: np.ndarray, weights: np.ndarray,
+                    n_genes: int, with_extremes: bool = True) -> tuple:
+    """
+    Enrichment score для всех наборов сразу
+
+    positions — позиции генов наборов подряд (отсортированы внутри каждого
+    набора). Максимум и минимум бегущей суммы достигаются на генах набора,
+    поэтому достаточно посчитать её только в этих точках.
+
+    Returns:
+        ES каждого набора и индекс (в positions) точки экстремума
+        (None, если with_extremes=False)
+    """
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    seg_starts = np.repeat(starts, sizes)
+    w = weights[positions]
+    cumulative = np.cumsum(w)
+    base = np.repeat(cumulative[starts] - w[starts], sizes)
+    hit_sum = cumulative - base
+    norm = np.repeat(np.add.reduceat(w, starts), sizes)
+    norm[norm == 0] = 1
+    hits_before = np.arange(len(positions)) - seg_starts
+    miss_share = (positions - hits_before) / np.repeat(n_genes - sizes, sizes)
+
+    after_hit = hit_sum / norm - miss_share
+    before_hit = (hit_sum - w) / norm - miss_share
+    max_dev = np.maximum.reduceat(after_hit, starts)
+    min_dev = np.minimum.reduceat(before_hit, starts)
+    scores = np.where(max_dev >= -min_dev, max_dev, min_dev)
+    if not with_extremes:
+        return scores, None
+
+    # Индекс точки экстремума: первый ген, на котором он достигается
+    extreme = np.where(np.repeat(max_dev >= -min_dev, sizes),
+                       after_hit == np.repeat(max_dev, sizes),
+                       before_hit == np.repeat(min_dev, sizes))
+    candidates = np.flatnonzero(extreme)
+    segments, first = np.unique(np.searchsorted(starts, candidates, side='right') - 1,
+                                return_index=True)
+    extreme_index = np.full(len(sizes), -1, dtype=np.int64)
+    extreme_index[segments] = candidates[first]
+    return scores, extreme_index
+
+
+def _permutation_batch(sizes: np.ndarray, weights: np.ndarray,
+                       n_permutations: int, seed: int) -> np.ndarray:
+    """
+    Нулевое распределение ES для батча перестановок меток генов
+
+    Нулевое распределение набора зависит только от его размера, поэтому
+    считается для каждого уникального размера: случайный набор размера k —
+    первые k генов случайной перестановки. Все перестановки батча
+    обрабатываются как один массив сегментов (перестановка × размер).
+    Функция уровня модуля, чтобы её можно было выполнить в пуле процессов.
+
+    Returns:
+        массив (n_permutations, len(sizes))
+    """
+    rng = np.random.default_rng(seed)
+    n_genes = len(weights)
+    batch_sizes = np.tile(sizes, n_permutations)
+    prefix = np.concatenate([np.arange(size) for size in sizes])
+    samples = np.stack([rng.choice(n_genes, sizes.max(), replace=False)
+                        for _ in range(n_permutations)])
+    positions = samples[:, prefix].ravel().astype(np.int64)
+    segment = np.repeat(np.arange(len(batch_sizes), dtype=np.int64), batch_sizes)
+    # Сортировка внутри сегментов одной глобальной сортировкой ключа (сегмент, позиция)
+    positions = np.sort(segment * n_genes + positions) - segment * n_genes
+    scores, _ = _segment_scores(positions, batch_sizes, weights, n_genes,
+                                with_extremes=False)
+    return scores.reshape(n_permutations, len(sizes)).astype(np.float32)
+
+
+def _benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    result = np.empty_like(adjusted)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+def preranked_gsea(ranking: pd.Series, gene_sets: dict, permutations: int = 1000,
+                   min_size: int = 15, max_size: int = 500, executor=None,
+                   seed: int = 0) -> pd.DataFrame:
+    """
+    Preranked GSEA (взвешенная бегущая сумма, p = 1) для всех наборов генов
+
+    Нулевое распределение строится перестановками меток генов, батчами,
+    отдельно для каждого уникального размера набора; батчи распределяются по executor (например, пулу процессов планировщика),
+    без него считаются последовательно. P-value — доля нулевых ES того же
+    знака, не меньших по модулю; поправка — Бенджамини–Хохберг.
+
+    Args:
+        ranking: метрика генов, отсортированная по убыванию (см. rank_genes)
+        gene_sets: словарь термин → список генов
+        executor: объект с методом submit (concurrent.futures.Executor)
+
+    Returns:
+        DataFrame с колонками Term, ES, NES, P-value, Adjusted P-value, Size,
+        Genes (leading edge), -log10(P-value) — как у результатов Enrichr
+    """
+    genes = ranking.index
+    weights = np.abs(ranking.to_numpy(dtype=np.float64))
+    n_genes = len(genes)
+    names, sizes, positions = _set_positions(gene_sets, genes, min_size, max_size)
+    if not names:
+        return pd.DataFrame(columns=['Term', 'ES', 'NES', 'P-value', 'Adjusted P-value',
+                                     'Size', 'Genes', '-log10(P-value)'])
+
+    scores, extreme_index = _segment_scores(positions, sizes, weights, n_genes)
+
+    unique_sizes, size_index = np.unique(sizes, return_inverse=True)
+    batch = max(1, min(permutations, MAX_BATCH_POSITIONS // unique_sizes.sum()))
+    batches = [(min(batch, permutations - start), seed + i)
+               for i, start in enumerate(range(0, permutations, batch))]
+    if executor is None:
+        null = [_permutation_batch(unique_sizes, weights, n, batch_seed)
+                for n, batch_seed in batches]
+    else:
+        futures = [executor.submit(_permutation_batch, unique_sizes, weights, n, batch_seed)
+                   for n, batch_seed in batches]
+        null = [future.result() for future in futures]
+    # Нулевое распределение каждого набора — столбец его размера
+    null = np.concatenate(null)[:, size_index]
+
+    positive = scores >= 0
+    same_sign = np.where(positive, null >= 0, null < 0)
+    n_same = same_sign.sum(axis=0)
+    beyond = np.where(positive, null >= scores, null <= scores) & same_sign
+    p_values = (beyond.sum(axis=0) + 1) / (n_same + 1)
+
+    null_pos_mean = np.where(null >= 0, null, 0).sum(axis=0) / np.maximum((null >= 0).sum(axis=0), 1)
+    null_neg_mean = -np.where(null < 0, null, 0).sum(axis=0) / np.maximum((null < 0).sum(axis=0), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        nes = np.where(positive, scores / null_pos_mean, scores / null_neg_mean)
+
+    # Leading edge: гены набора до точки экстремума (ES > 0) или после неё (ES < 0)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    leading_edge = []
+    for start, size, extreme, score in zip(starts, sizes, extreme_index, scores):
+        set_positions = positions[start:start + size]
+        if score >= 0:
+            edge = set_positions[:extreme - start + 1]
+        else:
+            edge = set_positions[extreme - start:]
+        leading_edge.append(genes[edge].tolist())
+
+    df = pd.DataFrame({
+        'Term': names,
+        'ES': scores,
+        'NES': nes,
+        'P-value': p_values,
+        'Adjusted P-value': _benjamini_hochberg(p_values),
+        'Size': sizes,
+        'Genes': leading_edge
+    })
+    df['-log10(P-value)'] = -np.log10(df['P-value'])
+    order = np.lexsort((-np.abs(df['ES'].to_numpy()), df['P-value'].to_numpy()))
+    return df.iloc[order].reset_index(drop=True)
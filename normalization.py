@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from expression_store import MEMORY_BUDGET, ExpressionStore, columns_per_block, staging_name
+
+LOG_MODES = ('auto', 'yes', 'no')
+
+
+def _row_sample(values: np.ndarray, max_rows: int = 20000) -> np.ndarray:
+    """Равномерная подвыборка строк для оценки распределения"""
+    step = max(1, values.shape[0] // max_rows)
+    return np.asarray(values[::step], dtype=np.float64)
+
+
+def needs_log_transform(values: np.ndarray) -> bool:
+    """
+    Определяет, нужно ли логарифмировать данные (эвристика GEO2R)
+
+    Квантили оцениваются по равномерной подвыборке строк.
+    """
+    sample = _row_sample(values)
+    sample = sample[~np.isnan(sample)]
+    if not sample.size:
+        return False
+    q = np.quantile(sample, [0, 0.25, 0.5, 0.75, 0.99, 1.0])
+    return bool(q[4] > 100 or (q[5] - q[0] > 50 and q[1] > 0))
+
+
+def log2_transform(values: np.ndarray, chunk_rows: int = 10000):
+    """Логарифмирует матрицу на месте по блокам строк; значения ≤ 0 → NaN"""
+    for start in range(0, values.shape[0], chunk_rows):
+        block = np.asarray(values[start:start + chunk_rows], dtype=np.float32)
+        block[block <= 0] = np.nan
+        np.log2(block, out=block)
+        values[start:start + chunk_rows] = block
+
+
+def _sorted_on_grid(column: np.ndarray, n: int) -> np.ndarray:
+    """Сортирует столбец без NaN и интерполирует его на сетку из n квантилей"""
+    valid = np.sort(column[~np.isnan(column)])
+    if valid.size == n:
+        return valid
+    if not valid.size:
+        return np.full(n, np.nan)
+    return np.interp(np.linspace(0, 1, n), np.linspace(0, 1, valid.size), valid)
+
+
+def quantile_normalize(values: np.ndarray, chunk_columns: int = None,
+                       memory_budget: int = MEMORY_BUDGET):
+    """
+    Квантильная нормализация на месте по блокам столбцов
+
+    Первый проход считает референсное распределение (среднее отсортированных
+    столбцов), второй — заменяет значения референсными квантилями по рангу.
+    NaN сохраняются на своих местах. Чтение блока столбцов из построчного
+    memmap проходит по всему файлу, поэтому по умолчанию блок занимает
+    половину memory_budget (float64; вторая половина — на временные массивы).
+    """
+    n_genes, n_samples = values.shape
+    chunk_columns = chunk_columns or columns_per_block(n_genes, 8, memory_budget // 2)
+    reference = np.zeros(n_genes, dtype=np.float64)
+    counts = np.zeros(n_genes, dtype=np.int64)
+
+    for start in range(0, n_samples, chunk_columns):
+        block = np.asarray(values[:, start:start + chunk_columns], dtype=np.float64)
+        for column in block.T:
+            grid = _sorted_on_grid(column, n_genes)
+            valid = ~np.isnan(grid)
+            reference[valid] += grid[valid]
+            counts[valid] += 1
+    reference = np.divide(reference, counts, out=np.full(n_genes, np.nan),
+                          where=counts > 0)
+
+    positions = np.linspace(0, 1, n_genes)
+    for start in range(0, n_samples, chunk_columns):
+        block = np.asarray(values[:, start:start + chunk_columns], dtype=np.float64)
+        for column in block.T:
+            valid = ~np.isnan(column)
+            n_valid = valid.sum()
+            if n_valid < 2:
+                continue
+            # Средние ранги: одинаковые значения получают одинаковый квантиль
+            ranks = pd.Series(column[valid]).rank(method='average').to_numpy()
+            column[valid] = np.interp((ranks - 1) / (n_valid - 1), positions, reference)
+        values[:, start:start + chunk_columns] = block
+
+
+def normalization_steps(values: np.ndarray, log_mode: str = 'auto',
+                        quantile: bool = True) -> dict:
+    """
+    Шаги, которые normalize выполнит для этих данных (данные не изменяются)
+
+    Returns:
+        словарь raw_scale_detected, log_transformed, quantile_normalized
+    """
+    if log_mode not in LOG_MODES:
+        raise ValueError(f"Unknown log mode: {log_mode}")
+
+    detected = needs_log_transform(values)
+    return {
+        'raw_scale_detected': detected,
+        'log_transformed': log_mode == 'yes' or (log_mode == 'auto' and detected),
+        'quantile_normalized': quantile
+    }
+
+
+def normalize(values: np.ndarray, log_mode: str = 'auto', quantile: bool = True,
+              chunk_rows: int = 10000, chunk_columns: int = None) -> dict:
+    """
+    Нормализует матрицу экспрессии (гены × образцы) на месте
+
+    Args:
+        values: массив или np.memmap, изменяется на месте
+        log_mode: 'auto' — log2 только если данные не логарифмированы,
+            'yes' — всегда, 'no' — никогда
+        quantile: выполнять ли квантильную нормализацию
+        chunk_columns: столбцов в блоке квантильной нормализации;
+            по умолчанию из MEMORY_BUDGET
+
+    Returns:
+        словарь с описанием выполненных шагов (см. normalization_steps)
+    """
+    steps = normalization_steps(values, log_mode, quantile)
+    if steps['log_transformed']:
+        log2_transform(values, chunk_rows)
+    if quantile:
+        quantile_normalize(values, chunk_columns)
+    if isinstance(values, np.memmap):
+        values.flush()
+    return steps
+
+
+def normalized_name(name: str, log_mode: str, quantile: bool) -> str:
+    """Имя нормализованного хранилища: своё для каждого набора параметров"""
+    return f"{name}_norm_{log_mode}_{int(quantile)}"
+
+
+def normalize_store(store: ExpressionStore, log_mode: str = 'auto',
+                    quantile: bool = True) -> ExpressionStore:
+    """
+    Нормализованная копия хранилища в той же папке
+
+    Копия собирается под staging-именем и публикуется переименованием, так что
+    уже опубликованное хранилище никогда не перезаписывается; если оно есть,
+    возвращается как есть. Функция уровня модуля для пула процессов.
+    """
+    name = normalized_name(store.name, log_mode, quantile)
+    if not ExpressionStore.exists(store.directory, name):
+        staging = staging_name(name)
+        try:
+            target = store.copy_to(store.directory, staging)
+            normalize(target.values, log_mode, quantile)
+            del target
+        except BaseException:
+            ExpressionStore.discard(store.directory, staging)
+            raise
+        ExpressionStore.publish(store.directory, staging, name)
+    return ExpressionStore(store.directory, name)
@@ -4,10 +4,23 @@ import pandas as pd
 import subprocess
 from pathlib import Path
 from datetime import datetime
+from expression_store import ExpressionStore
+from gene_ids import MISSING_ID, GeneIndex
+from phenotype import PhenotypeTable
+from soft_parser import soft_to_store
+from scheduler import current_user, get_scheduler, poll_job
+from warmup import start_warmup
+from normalization import LOG_MODES, normalization_steps, normalize_store, normalized_name
+from qc import CORRELATION_METHODS, correlation_matrix, detect_outliers
 
 # ========== Config ==========
 DATA_DIR = "data"
+# Серии GEO: .gz (series matrix или SOFT family) и несжатые SOFT файлы
+DATASET_EXTENSIONS = ('.gz', '.soft')
+PREVIEW_ROWS = 1000
+ALIAS_TABLE_PATH = os.path.join(DATA_DIR, "hgnc_complete_set.tsv")
 Path(DATA_DIR).mkdir(exist_ok=True)
+start_warmup()
 st.title("Загрузка GEO-файлов")
 
 # ========== Utility Functions ==========
@@ -42,14 +55,102 @@ def run_r_script(input_path, name):
     )
 
 
+def is_soft_file(filename):
+    return filename.endswith(('.soft.gz', '.soft'))
+
+
+def dataset_exists(name):
+    return ExpressionStore.exists(f"{DATA_DIR}//{name}", name)
+
+
+def csv_to_store(name):
+    # CSV, записанный R-скриптом, переписывается в хранилище внутри задачи,
+    # а не в потоке скрипта страницы
+    store_dir = f"{DATA_DIR}//{name}"
+    if not ExpressionStore.exists(store_dir, name):
+        return ExpressionStore.from_csv(f"{store_dir}//{name}_expr.csv", store_dir, name)
+    return ExpressionStore(store_dir, name)
+
+
+def process_geo(input_path, name):
+    run_r_script(input_path, name)
+    return csv_to_store(name)
+
+
+def submit_ingest_job(input_path, selected_file, name):
+    scheduler = get_scheduler()
+    store_dir = f"{DATA_DIR}//{name}"
+    if is_soft_file(selected_file):
+        # SOFT family файл разбирается потоково прямо в хранилище, без R
+        return scheduler.submit(
+            current_user(), soft_to_store, input_path, store_dir, name,
+            key=('soft', input_path))
+    if os.path.exists(f"{store_dir}//{name}_expr.csv"):
+        # R-скрипт уже выполнялся, осталось собрать хранилище
+        return scheduler.submit(
+            current_user(), csv_to_store, name, kind='io', key=('csv_to_store', store_dir))
+    return scheduler.submit(
+        current_user(), process_geo, input_path, name,
+        kind='io', key=('process_geo', input_path))
+
+
 def read_expression_data(name):
-    path = f"{DATA_DIR}//{name}//{name}_expr.csv"
-    return pd.read_csv(path, index_col=0).rename_axis('id')
+    return ExpressionStore(f"{DATA_DIR}//{name}", name).view()
+
 
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
 
+
+@st.cache_resource
+def load_alias_index(path, mtime):
+    # Общая для всех сессий таблица синонимов HGNC (если файл есть)
+    if mtime is None:
+        return None
+    return GeneIndex.from_alias_table(path)
+
+
+@st.cache_resource
+def build_gene_index(_store, values_path, store_mtime, alias_mtime):
+    # Вселенная и id строк строятся один раз на хранилище и версию таблицы синонимов,
+    # а не на каждый перезапуск скрипта
+    alias_index = load_alias_index(ALIAS_TABLE_PATH, alias_mtime)
+    if alias_index is None:
+        gene_index = GeneIndex.from_symbols(_store.genes)
+    else:
+        gene_index = alias_index.extend(_store.genes)
+    return gene_index, gene_index.lookup(_store.genes)
+
+
+def load_gene_index(store):
+    # Без таблицы синонимов гены сопоставляются только по символам без учёта регистра
+    alias_mtime = file_mtime(ALIAS_TABLE_PATH)
+    if alias_mtime is None:
+        st.info(f"Таблица синонимов {ALIAS_TABLE_PATH} не найдена: "
+                "гены сопоставляются только по символам (без учёта регистра)")
+    else:
+        try:
+            alias_index = load_alias_index(ALIAS_TABLE_PATH, alias_mtime)
+        except (KeyError, ValueError, OSError) as e:
+            st.warning(f"Не удалось прочитать таблицу синонимов {ALIAS_TABLE_PATH}: {e}. "
+                       "Гены сопоставляются только по символам (без учёта регистра)")
+            alias_mtime = None
+        else:
+            st.caption(f"Таблица синонимов HGNC загружена: {len(alias_index)} генов")
+
+    values_path = ExpressionStore.paths(store.directory, store.name)[0]
+    gene_index, gene_ids = build_gene_index(
+        store, values_path, file_mtime(values_path), alias_mtime)
+    store.gene_ids = gene_ids
+    st.session_state.gene_index = gene_index
+    return gene_index
+
+
+@st.cache_resource
 def read_phenotype_data(name):
+    # Таблица только читается, поэтому один экземпляр разделяется между сессиями
     path = f"{DATA_DIR}//{name}//{name}_phen.csv"
-    return pd.read_csv(path, index_col=0).rename_axis('id')
+    return PhenotypeTable.from_csv(path)
 
 
 def read_gene_list(txt_path):
@@ -64,6 +165,15 @@ def display_dataframe(title, df):
     st.dataframe(df)
 
 
+def display_expression(title, expr):
+    st.subheader(title)
+    n_genes, n_samples = expr.shape
+    st.write(f"Генов: {n_genes}, образцов: {n_samples}")
+    if n_genes > PREVIEW_ROWS:
+        st.caption(f"Показаны первые {PREVIEW_ROWS} генов")
+    st.dataframe(expr.to_frame(PREVIEW_ROWS))
+
+
 def file_selector(title, df, key):
     st.subheader(title)
     return st.dataframe(
@@ -84,9 +194,9 @@ def display_debug_info(gz_selection):
 
 
 def main():
-    files_df = get_files('.gz')
+    files_df = get_files(DATASET_EXTENSIONS)
     if files_df.empty:
-        st.warning("GZ файлы не найдены в папке 'data'")
+        st.warning("GZ и SOFT файлы не найдены в папке 'data'")
         return
 
     gz_selection = file_selector(
@@ -101,31 +211,164 @@ def main():
     input_path = os.path.join(DATA_DIR, selected_file)
     name = extract_name_from_path(input_path)
 
-    with st.spinner(f"Processing {selected_file}..."):
-        try:
-            output_expr_path = f"{DATA_DIR}//{name}//{name}_expr.csv"
-            if not os.path.exists(output_expr_path):
-                run_r_script(input_path, name)
-                st.success(f"Successfully processed {selected_file}!")
+    dataset = load_dataset(input_path, selected_file, name)
+    if dataset is not None:
+        expr, phen = dataset
+        display_expression("Матрица экспрессии", expr)
+        display_dataframe("Данные фенотипов", phen.data)
 
-            if os.path.exists(output_expr_path):
-                expr_df = read_expression_data(name)
-                phen_df = read_phenotype_data(name)
+        expr = handle_normalization(expr, name)
+        gene_index = load_gene_index(expr.store)
+        handle_quality_control(expr)
+        handle_gene_list_and_filtering(expr, phen, gene_index)
+
+    display_debug_info(gz_selection)
 
-                display_dataframe("Матрица экспрессии", expr_df)
-                display_dataframe("Данные фенотипов", phen_df)
 
-                handle_gene_list_and_filtering(expr_df, phen_df)
+def load_dataset(input_path, selected_file, name):
+    # Ошибки обработки файла перехватываются только здесь, чтобы не скрывать
+    # ошибки остальной страницы
+    with st.spinner(f"Processing {selected_file}..."):
+        try:
+            # Готовность определяется завершением задачи, а не появлением файлов;
+            # задача своя у каждого датасета, чтобы выбор другого файла её не подхватил
+            job_key = f"ingest_job_{name}"
+            if job_key in st.session_state or not dataset_exists(name):
+                if job_key not in st.session_state:
+                    st.session_state[job_key] = submit_ingest_job(
+                        input_path, selected_file, name)
+                if poll_job(job_key, f"Processing {selected_file}...",
+                            cancellable=False) is not None:
+                    st.success(f"Successfully processed {selected_file}!")
+
+            if not dataset_exists(name):
+                return None
+            return read_expression_data(name), read_phenotype_data(name)
 
         except subprocess.CalledProcessError as e:
             st.error(f"Processing failed: {e.stderr}")
+        except ValueError as e:
+            st.error(f"Processing failed: {e}")
+    return None
 
-    display_debug_info(gz_selection)
+# ========== Normalization ==========
+
+
+@st.cache_data
+def normalization_report(store_dir, store_name, mtime, log_mode, quantile):
+    # Эвристика считается по подвыборке строк; кэш сбрасывается при изменении файла
+    values = ExpressionStore(store_dir, store_name).values
+    return normalization_steps(values, log_mode, quantile)
+
+
+def handle_normalization(expr, name):
+    st.markdown("---")
+    st.subheader("Нормализация")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        log_mode = st.selectbox(
+            "Log2-преобразование:", LOG_MODES, key="log_mode_selector")
+    with col2:
+        quantile = st.checkbox(
+            "Квантильная нормализация", value=True, key="quantile_normalization")
+
+    store = expr.store
+    values_path = ExpressionStore.paths(store.directory, store.name)[0]
+    report = normalization_report(store.directory, store.name,
+                                  os.path.getmtime(values_path), log_mode, quantile)
+
+    # Нелогарифмированные данные по умолчанию заменяются нормализованными
+    use_normalized = st.checkbox(
+        "Использовать нормализованные данные", value=report['raw_scale_detected'],
+        key=f"use_normalized_{name}")
+    if not use_normalized:
+        if report['raw_scale_detected']:
+            st.warning("Данные не логарифмированы: log2 fold change по исходной шкале "
+                       "будет некорректным. Включите нормализацию.")
+        else:
+            st.info("Используются исходные (ненормализованные) данные")
+        return expr
+
+    norm_name = normalized_name(store.name, log_mode, quantile)
+    if not ExpressionStore.exists(store.directory, norm_name):
+        # Упавшая задача не перезапускается, пока не изменятся параметры
+        failed = st.session_state.get('normalize_error')
+        if failed and failed[0] == (store.directory, norm_name):
+            st.error(f"Ошибка нормализации: {failed[1]}")
+            return expr
+        # Задача своя у каждого набора параметров: смена параметров не подхватывает
+        # чужой результат, а возврат к прежним продолжает опрос их задачи
+        job_key = f"normalize_job_{norm_name}"
+        if job_key not in st.session_state:
+            st.session_state[job_key] = get_scheduler().submit(
+                current_user(), normalize_store, store, log_mode, quantile,
+                key=('normalize', store.directory, norm_name))
+        try:
+            poll_job(job_key, "Нормализуем данные...", cancellable=False)
+        except Exception as e:
+            st.session_state.normalize_error = ((store.directory, norm_name), str(e))
+        st.rerun()
+
+    st.write(f"Данные в исходной шкале: {'да' if report['raw_scale_detected'] else 'нет'}")
+    st.write(f"Log2-преобразование: {'да' if report['log_transformed'] else 'нет'}")
+    st.write(f"Квантильная нормализация: {'да' if report['quantile_normalized'] else 'нет'}")
+
+    norm_expr = ExpressionStore(store.directory, norm_name).view()
+    display_expression("Нормализованная матрица экспрессии", norm_expr)
+    return norm_expr
+
+# ========== Quality Control ==========
+
+
+def handle_quality_control(expr):
+    st.markdown("---")
+    st.subheader("Контроль качества образцов")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        method = st.selectbox(
+            "Метод корреляции:", CORRELATION_METHODS, key="qc_method_selector")
+    with col2:
+        threshold = st.number_input(
+            "Порог выброса (робастный z):", min_value=0.5, value=3.0, step=0.5, key="qc_threshold")
+
+    # Корреляции зависят от того, какое хранилище (исходное или нормализованное) выбрано
+    qc_key = (expr.store.name, method)
+    if st.button("Рассчитать корреляции образцов", key="run_qc"):
+        with st.spinner("Считаем корреляции образцов..."):
+            st.session_state.qc_results = {
+                'key': qc_key,
+                'corr': correlation_matrix(expr, method)
+            }
+
+    qc_results = st.session_state.get('qc_results')
+    if not qc_results or qc_results['key'] != qc_key:
+        st.session_state.excluded_samples = []
+        return
+
+    corr_df = qc_results['corr']
+    # Порог нужен и странице экспорта, чтобы отметить те же выбросы
+    qc_results['threshold'] = threshold
+    outliers = detect_outliers(corr_df, threshold)
+    flagged = outliers.index[outliers['is_outlier']].tolist()
+
+    st.write(f"Найдено выбросов: {len(flagged)}")
+    st.dataframe(outliers.sort_values('median_correlation'))
+    # Кластеризация и отрисовка дорогие: PNG кэшируется для пары (qc_key, порог)
+    if qc_results.get('figure_threshold') != threshold:
+        from plots import figure_png, plot_correlation_heatmap
+        qc_results['figure'] = figure_png(plot_correlation_heatmap(corr_df, outliers))
+        qc_results['figure_threshold'] = threshold
+    st.image(qc_results['figure'])
+
+    st.session_state.excluded_samples = st.multiselect(
+        "Исключить образцы из групп:", corr_df.index.tolist(), default=flagged, key="qc_excluded_samples")
 
 # ========== Gene List Selection and Filtering ==========
 
 
-def handle_gene_list_and_filtering(expr_df, phen_df):
+def handle_gene_list_and_filtering(expr, phen, gene_index):
     st.markdown("---")
     txt_files_df = get_files('.txt')
 
@@ -138,52 +381,55 @@ def handle_gene_list_and_filtering(expr_df, phen_df):
     select_all = st.checkbox(
         "Выбрать все гены", value=False, key="select_all_genes")
 
-    filtered_expr = expr_df
+    filtered_expr = expr
     if not select_all and txt_selection['selection']['rows']:
         row = txt_selection['selection']['rows'][0]
         txt_file = txt_files_df.iloc[row]["Имя файла"]
         txt_path = os.path.join(DATA_DIR, txt_file)
         gene_list = read_gene_list(txt_path)
 
-        filtered_expr = expr_df[expr_df.index.isin(gene_list)]
-        st.subheader(f"Отфильтрованная матрица экспресси (по {txt_file})")
+        filtered_expr = expr.filter_genes(gene_list, gene_index)
+        unknown = (gene_index.lookup(gene_list) == MISSING_ID).sum()
         st.write(f"Генов в списке: {len(gene_list)}")
-        st.write(f"Генов, найденных в матрице: {len(filtered_expr)}")
-        st.dataframe(filtered_expr)
+        st.write(f"Не распознано идентификаторов: {unknown}")
+        st.write(f"Генов, найденных в матрице: {filtered_expr.shape[0]}")
+        display_expression(
+            f"Отфильтрованная матрица экспресси (по {txt_file})", filtered_expr)
 
     if not filtered_expr.empty:
-        handle_phenotype_filtering(filtered_expr, phen_df)
+        handle_phenotype_filtering(filtered_expr, phen)
 
 # ========== Phenotype Filtering and Group Creation ==========
 
 
-def handle_phenotype_filtering(filtered_expr, phen_df):
+def handle_phenotype_filtering(filtered_expr, phen):
     st.markdown("---")
     st.subheader("Группировка по фенотипу")
 
-    phen_columns = [
-        col for col in phen_df.columns if col != phen_df.index.name]
+    phen_columns = phen.columns
     if not phen_columns:
         st.warning("Не найдено колонок с фенотипами для группировки")
         return
 
     selected_col = st.selectbox(
         "Выберите колонку фенотипа для группировки:", phen_columns, key="phen_column_selector")
-    values = phen_df[selected_col].unique()
+    values = phen.values(selected_col)
     selected_values = st.multiselect(
         f"Выберите значения из {selected_col}, которые нужно оставить:", values, default=values, key="phen_value_selector")
 
     if not selected_values:
         return
 
-    filtered_samples = phen_df[phen_df[selected_col].isin(
-        selected_values)].index.tolist()
-    final_filtered = filtered_expr[filtered_samples]
+    excluded_samples = st.session_state.get('excluded_samples', [])
+    filtered_samples = phen.samples_for(
+        selected_col, selected_values, excluded_samples)
+    final_filtered = filtered_expr.select_samples(filtered_samples)
 
-    display_dataframe("Финальная матрица экспрессии", final_filtered)
+    display_expression("Финальная матрица экспрессии", final_filtered)
 
     if st.button("Создать датасеты по группам", key="create_group_datasets"):
-        create_group_datasets(filtered_expr, phen_df, selected_col)
+        create_group_datasets(filtered_expr, phen,
+                              selected_col, excluded_samples)
 
     if 'group_datasets' in st.session_state and st.session_state.group_datasets:
         display_group_datasets()
@@ -191,17 +437,18 @@ def handle_phenotype_filtering(filtered_expr, phen_df):
 # ========== Group Dataset Logic ==========
 
 
-def create_group_datasets(expr_df, phen_df, phen_column):
-    groups = phen_df[phen_column].unique()
+def create_group_datasets(expr, phen, phen_column, excluded_samples=()):
     group_datasets = {}
     avg_group_datasets = {}
 
-    for group in groups:
-        sample_ids = phen_df[phen_df[phen_column] == group].index.tolist()
-        group_data = expr_df[sample_ids]
+    for group in phen.values(phen_column):
+        sample_ids = phen.samples_for(phen_column, [group], excluded_samples)
+        if sample_ids.empty:
+            continue
+        group_data = expr.select_samples(sample_ids)
         group_datasets[group] = group_data
         avg_group_datasets[group] = pd.DataFrame(
-            {'Expression': group_data.mean(axis=1)})
+            {'Expression': group_data.row_means()})
 
     combined_df = pd.concat([
         df.reset_index()
@@ -217,7 +464,7 @@ def create_group_datasets(expr_df, phen_df, phen_column):
         'datasets': group_datasets,
         'avg': combined_df
     }
-    st.success(f"Создано {len(groups)} датасетов по группам!")
+    st.success(f"Создано {len(group_datasets)} датасетов по группам!")
 
 
 def display_group_datasets():
@@ -231,7 +478,7 @@ def display_group_datasets():
     for tab, group in zip(tabs, groups):
         with tab:
             st.write(f"Образцов в группе: {len(datasets[group].columns)}")
-            st.dataframe(datasets[group])
+            st.dataframe(datasets[group].to_frame(PREVIEW_ROWS))
 
     st.markdown("---")
     st.subheader("Датасет со средними значениями экспрессии по группам")
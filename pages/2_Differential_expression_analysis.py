@@ -1,15 +1,12 @@
 import streamlit as st
-from streamlit_theme import st_theme
 import pandas as pd
-import plotly.express as px
-from pathlib import Path
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
-from scipy.stats import ttest_ind
+from scheduler import current_user, get_scheduler, poll_job
+from warmup import start_warmup
 
 st.set_page_config(page_title="Дифференциальный анализ экспрессии")
 st.title("Дифференциальный анализ экспрессии")
+start_warmup()
 
 
 def validate_session_state():
@@ -35,20 +32,6 @@ def select_groups():
     return group1, group2
 
 
-def calculate_de_stats(control, case):
-    mean_control = control.mean(axis=1)
-    mean_case = case.mean(axis=1)
-    fold_change = mean_case - mean_control
-    p_values = [ttest_ind(case.loc[idx], control.loc[idx], equal_var=False)[
-        1] for idx in control.index]
-    return pd.DataFrame({
-        'gene': control.index,
-        'log2_fold_change': fold_change,
-        'p_value': p_values,
-        '-log10_pvalue': -np.log10(p_values)
-    }).reset_index(drop=True)
-
-
 def get_text_color():
     # theme = dict(st_theme())
     # return theme["textColor"]
@@ -57,6 +40,8 @@ def get_text_color():
 
 
 def plot_volcano(results, group1, group2, top_genes=10, fc_threshold=1, P_VALUE=0.05):
+    import plotly.express as px
+
     BLUE = '#36a2eb'
     RED = '#ff6384'
     GREEN = '#4bc0c0'
@@ -133,25 +118,25 @@ def plot_volcano(results, group1, group2, top_genes=10, fc_threshold=1, P_VALUE=
 
 
 def plot_heatmap(group1, group2, group1_data, group2_data, top_genes, fc_threshold, P_VALUE=0.05, width=4, height=40):
+    import matplotlib.pyplot as plt
+    from plots import plot_group_heatmap
+
     # Calculate mean expression per group for top genes
     mean_expr = pd.DataFrame({
-        group1: group1_data.loc[top_genes].mean(axis=1),
-        group2: group2_data.loc[top_genes].mean(axis=1)
+        group1: group1_data.select_genes(top_genes).row_means(),
+        group2: group2_data.select_genes(top_genes).row_means()
     })
 
     # print(mean_expr.head(10))
     mean_expr.sort_values('id', inplace=True)
-    plt.rcParams.update({'font.size': 6})
-
-    fig = plt.figure(figsize=(width, height))
-    sns.heatmap(mean_expr, annot=True, fmt='.2f',
-                linewidths=0.5, cmap='plasma')
-    plt.title(
-        f'Средняя экспрессия топ-{len(top_genes)} генов (|FC| ≥ {fc_threshold} & p-value < {P_VALUE})')
-    plt.xlabel('Группа')
-    plt.ylabel('Ген')
+
+    fig = plot_group_heatmap(
+        mean_expr,
+        f'Средняя экспрессия топ-{len(top_genes)} генов (|FC| ≥ {fc_threshold} & p-value < {P_VALUE})',
+        figsize=(width, height))
     st.subheader("Тепловая карта Средней экспрессии по группам")
     st.pyplot(fig)
+    plt.close(fig)
 
 # def plot_heatmap(group1, group2, group1_data, group2_data, top_genes, fc_threshold):
 #     mean_expr = pd.DataFrame({
@@ -191,11 +176,23 @@ def main():
     height = float(st.text_input("Heatmap height", "40"))
 
     if st.button("Запустить дифференциальный анализ экспрессии"):
-        with st.spinner("Считаем дифференциальную экспрессию..."):
-            results = calculate_de_stats(df_group1, df_group2)
-            st.session_state.analysis_results = results
-            st.subheader("Все результаты дифф. экспрессии")
-            st.dataframe(results.sort_values('p_value'))
+        # Импорт здесь: de_analysis тянет scipy, который нужен только для расчёта
+        from de_analysis import calculate_de_stats
+        st.session_state.de_job = get_scheduler().submit(
+            current_user(), calculate_de_stats, df_group1, df_group2,
+            key=('de', df_group1.fingerprint(), df_group2.fingerprint()))
+        # Группы, с которыми запущен расчёт: селекторы могут измениться до его завершения
+        st.session_state.de_job_groups = (group1, group2)
+
+    results = poll_job('de_job', "Считаем дифференциальную экспрессию...")
+    if results is not None:
+        st.session_state.analysis_results = results
+        # Результаты всех сравнений сессии попадают в экспорт
+        control, case = st.session_state.pop('de_job_groups', (group1, group2))
+        st.session_state.setdefault('de_contrasts', {})[f"{case}_vs_{control}"] = {
+            'control': control, 'case': case, 'results': results}
+        st.subheader("Все результаты дифф. экспрессии")
+        st.dataframe(results.sort_values('p_value'))
 
     if 'analysis_results' in st.session_state:
         results = st.session_state.analysis_results
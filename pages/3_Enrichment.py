@@ -11,6 +11,71 @@ st.title("Gene Enrichment Analysis")
 #     st.stop()
 
 from enrichr_analyzer import EnrichrAnalyzer
+from scheduler import current_user, get_scheduler, poll_job
+from warmup import start_warmup
+
+start_warmup()
+
+LIBRARIES = ["KEGG_2016", "GO_Biological_Process_2021"]
+ENRICHR_MODE = "Enrichr (top genes)"
+GSEA_MODE = "Preranked GSEA (all genes)"
+
+
+def run_gsea(de_results, library, permutations, min_size, max_size, gene_index, executor):
+    # Выполняется в пуле потоков планировщика; перестановки уходят в пул процессов
+    # батчами, не больше лимита пользователя одновременно
+    from gsea import preranked_gsea, rank_genes
+    gene_sets = EnrichrAnalyzer().get_gene_set_library(library)
+    ranking = rank_genes(de_results, gene_index)
+    return preranked_gsea(ranking, gene_sets, permutations, min_size, max_size,
+                          executor=executor)
+
+
+def gsea_section():
+    if 'analysis_results' not in st.session_state:
+        st.warning("Run differential expression analysis on the previous page first!")
+        return
+
+    de_results = st.session_state.analysis_results
+    gene_index = st.session_state.get('gene_index')
+    library = st.selectbox("Select library", LIBRARIES, key="gsea_library")
+    permutations = st.number_input(
+        "Permutations", min_value=100, max_value=10000, value=1000, step=100)
+    min_size, max_size = st.slider("Gene set size", 5, 1000, (15, 500))
+
+    if st.button("Run GSEA"):
+        scheduler, user = get_scheduler(), current_user()
+        de_hash = int(pd.util.hash_pandas_object(de_results).sum())
+        st.session_state.gsea_job = scheduler.submit(
+            user, run_gsea, de_results, library, permutations,
+            min_size, max_size, gene_index, scheduler.batch_executor(user),
+            kind='io', key=('gsea', de_hash, library, permutations, min_size, max_size))
+
+    results = poll_job('gsea_job', "Running GSEA...")
+    if results is not None:
+        st.session_state.gsea_results = results
+
+    if 'gsea_results' in st.session_state:
+        results = st.session_state.gsea_results
+        st.subheader("GSEA Results")
+        st.write(f"Gene sets tested: {len(results)}")
+        st.dataframe(results)
+
+        if not results.empty:
+            top_terms = st.slider("Terms in network", 1, min(50, len(results)),
+                                  min(20, len(results)), key="gsea_top_terms")
+            st.subheader("Enrichment Network")
+            import matplotlib.pyplot as plt
+            from plots import plot_enrichment_network
+            fig = plot_enrichment_network(results.head(top_terms), gene_index=gene_index)
+            st.pyplot(fig)
+            plt.close(fig)
+
+
+mode = st.radio("Method", [ENRICHR_MODE, GSEA_MODE], horizontal=True, key="enrichment_mode")
+if mode == GSEA_MODE:
+    gsea_section()
+    st.stop()
 
 # Ввод данных
 if 'top_genes' in st.session_state and st.session_state.top_genes:
@@ -23,15 +88,27 @@ if 'top_genes' in st.session_state and st.session_state.top_genes:
                                     )
 
     description = st.text_input("Analysis description")
-    library = st.selectbox("Select library", ["KEGG_2016", "GO_Biological_Process_2021"])
+    library = st.selectbox("Select library", LIBRARIES)
+
+    gene_index = st.session_state.get('gene_index')
+    if gene_index is not None:
+        # Синонимы и Entrez/Ensembl id приводятся к каноническим символам HGNC
+        selected_genes = list(dict.fromkeys(gene_index.canonical(selected_genes)))
 
+    analyzer = EnrichrAnalyzer()
     if len(selected_genes) and st.button("Run Analysis"):
-        analyzer = EnrichrAnalyzer()
-        
-        # Получаем результаты
-        with st.spinner("Running enrichment analysis..."):
-            results = analyzer.enrich(selected_genes, description, library)
-        
+        # Запрос к Enrichr выполняется в пуле потоков планировщика
+        st.session_state.enrichr_job = get_scheduler().submit(
+            current_user(), analyzer.enrich, selected_genes, description, library,
+            kind='io', key=('enrichr', tuple(selected_genes), description, library))
+
+    results = poll_job('enrichr_job', "Running enrichment analysis...")
+    if results is not None:
+        st.session_state.enrichment_results = results
+
+    if 'enrichment_results' in st.session_state:
+        results = st.session_state.enrichment_results
+
         # Показываем таблицу
         st.subheader("Enrichment Results")
         st.dataframe(results)
@@ -105,4 +182,8 @@ if 'top_genes' in st.session_state and st.session_state.top_genes:
         
         # Показываем сеть
         st.subheader("Enrichment Network")
-        analyzer.plot_enrichment_network(results)
+        import matplotlib.pyplot as plt
+        from plots import plot_enrichment_network
+        fig = plot_enrichment_network(results, gene_index=gene_index)
+        st.pyplot(fig)
+        plt.close(fig)
@@ -0,0 +1,176 @@
+import os
+import time
+from datetime import datetime
+from functools import partial
+import streamlit as st
+import pandas as pd
+from scheduler import current_session, current_user, get_scheduler, poll_job
+from warmup import start_warmup
+
+st.set_page_config(page_title="Экспорт результатов")
+st.title("Экспорт результатов")
+start_warmup()
+
+EXPORT_DIR = os.path.join("data", "exports")
+TABLE_FORMATS = ['csv', 'parquet', 'xlsx']
+FIGURE_FORMATS = ['png', 'svg']
+FC_THRESHOLD = 1
+# Архивы старше суток удаляются при сборке нового
+EXPORT_TTL = 24 * 3600
+
+
+def significant_genes(results, fc_threshold, p_value, top_genes):
+    significant = results[(results['p_value'] < p_value) &
+                          (results['log2_fold_change'].abs() >= fc_threshold)]
+    return significant.sort_values('p_value').head(top_genes)['gene'].tolist()
+
+
+def network_table(results, gene_index, top_terms=20):
+    # Гены приводятся к каноническим символам здесь, чтобы не передавать индекс в процессы
+    results = results.head(top_terms).copy()
+    if gene_index is not None:
+        results['Genes'] = [gene_index.canonical(genes) for genes in results['Genes']]
+    return results
+
+
+def has_results():
+    # Дешёвая проверка без сборки таблиц: collect_export читает хранилища
+    enrichment = [st.session_state.get(key) for key in ('enrichment_results', 'gsea_results')]
+    return bool(st.session_state.get('de_contrasts') or st.session_state.get('group_datasets')
+                or st.session_state.get('qc_results')
+                or any(results is not None and not results.empty for results in enrichment))
+
+
+def collect_export(include_matrices, fc_threshold, p_value, top_genes):
+    """Таблицы и описания фигур из результатов текущей сессии"""
+    tables, figures = {}, {}
+    group_datasets = st.session_state.get('group_datasets')
+    contrasts = st.session_state.get('de_contrasts', {})
+    gene_index = st.session_state.get('gene_index')
+
+    for name, contrast in contrasts.items():
+        results = contrast['results']
+        tables[f"de_{name}"] = results
+        figures[f"volcano_{name}"] = ('plot_volcano', (results, f"Volcano Plot: {name}"), {
+            'fc_threshold': fc_threshold, 'p_value': p_value, 'top_genes': top_genes})
+
+        genes = significant_genes(results, fc_threshold, p_value, top_genes)
+        if genes and group_datasets:
+            datasets = group_datasets['datasets']
+            control, case = contrast['control'], contrast['case']
+            if control in datasets and case in datasets:
+                mean_expr = pd.DataFrame({
+                    control: datasets[control].select_genes(genes).row_means(),
+                    case: datasets[case].select_genes(genes).row_means()
+                }).sort_values('id')
+                figures[f"heatmap_{name}"] = ('plot_group_heatmap', (
+                    mean_expr, f"Средняя экспрессия топ-{len(genes)} генов: {name}"), {
+                    'figsize': (4, max(4, 0.2 * len(genes)))})
+
+    if group_datasets:
+        tables['group_means'] = group_datasets['avg'].T
+        if include_matrices:
+            for group, view in group_datasets['datasets'].items():
+                tables[f"group_{group}"] = view
+
+    for name, key in (('enrichr', 'enrichment_results'), ('gsea', 'gsea_results')):
+        results = st.session_state.get(key)
+        if results is not None and not results.empty:
+            tables[name] = results
+            figures[f"network_{name}"] = ('plot_enrichment_network',
+                                          (network_table(results, gene_index),), {})
+
+    qc_results = st.session_state.get('qc_results')
+    if qc_results:
+        from qc import detect_outliers
+        corr_df = qc_results['corr']
+        tables['qc_correlation'] = corr_df
+        figures['qc_correlation'] = ('plot_correlation_heatmap', (
+            corr_df, detect_outliers(corr_df, qc_results['threshold'])), {})
+    return tables, figures
+
+
+def remove_export(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Архив уже удалён (например, другой сессией)
+        pass
+
+
+def prune_exports():
+    now = time.time()
+    for item in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, item)
+        try:
+            expired = item.endswith('.zip') and now - os.path.getmtime(path) > EXPORT_TTL
+        except FileNotFoundError:
+            continue
+        if expired:
+            remove_export(path)
+
+
+def read_export(path):
+    # Вызывается Streamlit только при нажатии «Скачать», а не при каждом перезапуске
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def build_bundle(path, tables, figures, table_formats, figure_formats, executor):
+    # Выполняется в пуле потоков планировщика; фигуры строятся в пуле процессов
+    from export import write_bundle
+    try:
+        write_bundle(path, tables, figures, table_formats, figure_formats, executor=executor)
+    except BaseException:
+        # Недописанный архив не остаётся в папке экспорта
+        remove_export(path)
+        raise
+    return path
+
+
+def main():
+    col1, col2 = st.columns(2)
+    with col1:
+        table_formats = st.multiselect("Форматы таблиц", TABLE_FORMATS, default=['csv', 'xlsx'])
+        include_matrices = st.checkbox("Матрицы экспрессии групп", value=False)
+    with col2:
+        figure_formats = st.multiselect("Форматы графиков", FIGURE_FORMATS, default=FIGURE_FORMATS)
+        p_value = float(st.text_input("P-value", "0.05", key="export_p_value"))
+        top_genes = st.number_input("Число генов на графиках", 1, 500, 50)
+
+    if not has_results():
+        st.warning("Нет результатов для экспорта: сначала выполните анализ на предыдущих страницах!")
+        st.stop()
+
+    if st.button("Собрать архив"):
+        tables, figures = collect_export(include_matrices, FC_THRESHOLD, p_value, top_genes)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        # Предыдущий архив сессии заменяется новым
+        previous = st.session_state.pop('export_path', None)
+        if previous:
+            remove_export(previous)
+        prune_exports()
+        path = os.path.join(
+            EXPORT_DIR, f"dge_export_{current_session()[:8]}_{datetime.now():%Y%m%d_%H%M%S}.zip")
+        scheduler, user = get_scheduler(), current_user()
+        st.session_state.export_job = scheduler.submit(
+            user, build_bundle, path, tables,
+            figures if figure_formats else {}, table_formats, figure_formats,
+            scheduler.batch_executor(user), kind='io')
+
+    try:
+        path = poll_job('export_job', "Собираем архив...")
+    except Exception as e:
+        st.error(f"Не удалось собрать архив: {e}")
+        path = None
+    if path is not None:
+        st.session_state.export_path = path
+
+    path = st.session_state.get('export_path')
+    if path and os.path.exists(path):
+        st.success(f"Архив сохранён: {path}")
+        st.download_button("Скачать архив", partial(read_export, path),
+                           file_name=os.path.basename(path), mime="application/zip")
+
+
+main()
@@ -0,0 +1,105 @@
+import re
+import numpy as np
+import pandas as pd
+
+CHARACTERISTICS_PATTERN = re.compile(r'^characteristics_(ch\d+)(?:\.\d+)?$')
+
+
+def parse_characteristics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Разбивает колонки characteristics_chN.* формата "ключ: значение" на отдельные колонки
+
+    Новые колонки называются "ключ:chN", как в GEOquery; если такая колонка уже
+    есть в таблице, она не перезаписывается. Исходная колонка удаляется, только
+    если разобраны все её значения; колонка со значениями без ключа (например,
+    "tumor") остаётся под своим именем.
+    """
+    raw_columns = [col for col in df.columns if CHARACTERISTICS_PATTERN.match(str(col))]
+    if not raw_columns:
+        return df
+
+    parsed, unparsed_columns = [], set()
+    for channel in sorted({CHARACTERISTICS_PATTERN.match(col).group(1) for col in raw_columns}):
+        columns = [col for col in raw_columns
+                   if CHARACTERISTICS_PATTERN.match(col).group(1) == channel]
+        # Длинная форма (образец, "ключ: значение") для всех колонок канала сразу
+        long = df[columns].stack()
+        pairs = long.astype(str).str.extract(r'^\s*([^:]+?)\s*:\s*(.*?)\s*$')
+        pairs.columns = ['key', 'value']
+        pairs['sample'] = long.index.get_level_values(0)
+        unparsed_columns.update(long.index.get_level_values(1)[pairs['key'].isna().to_numpy()])
+        pairs = pairs.dropna(subset=['key']).drop_duplicates(['sample', 'key'])
+        pairs['key'] = pairs['key'] + f':{channel}'
+        parsed.append(pairs.pivot(index='sample', columns='key', values='value'))
+
+    wide = pd.concat(parsed, axis=1).reindex(df.index)
+    wide = wide[[col for col in wide.columns if col not in df.columns]]
+    wide.columns.name = None
+    parsed_columns = [col for col in raw_columns if col not in unparsed_columns]
+    return pd.concat([df.drop(columns=parsed_columns), wide], axis=1)
+
+
+def compact_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Числовые по содержанию колонки → float, остальные строковые → category"""
+    result = {}
+    for col in df.columns:
+        column = df[col]
+        if pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):
+            numeric = pd.to_numeric(column, errors='coerce')
+            if numeric.notna().sum() == column.notna().sum() and column.notna().any():
+                column = numeric
+            else:
+                column = column.astype('category')
+        result[col] = column
+    return pd.DataFrame(result, index=df.index)
+
+
+def _build_group_index(column: pd.Series) -> dict:
+    """Словарь значение → позиции образцов (int32); пропуски не входят ни в одну группу"""
+    codes, uniques = pd.factorize(column, sort=True)
+    order = np.argsort(codes, kind='stable')
+    order = order[(codes < 0).sum():].astype(np.int32)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return dict(zip(list(uniques), np.split(order, np.cumsum(counts)[:-1])))
+
+
+class PhenotypeTable:
+    """
+    Типизированная таблица фенотипов с индексом групп
+
+    Для каждой колонки заранее строится словарь значение → позиции образцов,
+    поэтому выбор образцов по значениям — объединение готовых массивов.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.data = compact_types(parse_characteristics(df))
+        self.samples = self.data.index
+        self._group_index = {col: _build_group_index(self.data[col])
+                             for col in self.data.columns}
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'PhenotypeTable':
+        return cls(pd.read_csv(path, index_col=0).rename_axis('id'))
+
+    @property
+    def columns(self) -> list:
+        return list(self.data.columns)
+
+    def values(self, column: str) -> list:
+        """Уникальные значения колонки (без пропусков)"""
+        return list(self._group_index[column])
+
+    def sample_positions(self, column: str, values, exclude=()) -> np.ndarray:
+        """Позиции образцов, у которых значение колонки входит в values"""
+        groups = self._group_index[column]
+        parts = [groups[value] for value in values if value in groups]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        positions = np.sort(np.concatenate(parts))
+        if len(exclude):
+            positions = positions[~self.samples[positions].isin(exclude)]
+        return positions
+
+    def samples_for(self, column: str, values, exclude=()) -> pd.Index:
+        """Идентификаторы образцов, у которых значение колонки входит в values"""
+        return self.samples[self.sample_positions(column, values, exclude)]
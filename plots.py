@@ -0,0 +1,172 @@
+# Модуль тянет matplotlib, seaborn и networkx, поэтому страницы импортируют
+# его только там, где график действительно строится
+import numpy as np
+import pandas as pd
+import networkx as nx
+import matplotlib.pyplot as plt
+import seaborn as sns
+from gene_ids import GeneIndex
+
+
+def figure_png(fig, dpi=100) -> bytes:
+    """Рендерит фигуру в PNG и закрывает её, чтобы pyplot не держал фигуру в памяти"""
+    import io
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=dpi)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def plot_correlation_heatmap(corr_df: pd.DataFrame, outliers: pd.DataFrame = None,
+                             figsize=(10, 10)):
+    """
+    Строит кластеризованную тепловую карту корреляций
+
+    Выбросы отмечаются красной полосой над столбцами. Возвращает фигуру.
+    """
+    col_colors = None
+    if outliers is not None:
+        col_colors = outliers['is_outlier'].map(
+            {True: '#ff6384', False: '#36a2eb'}).rename('outlier')
+
+    show_labels = len(corr_df) <= 60
+    grid = sns.clustermap(
+        corr_df.fillna(0).astype(np.float64),
+        method='average',
+        cmap='viridis',
+        col_colors=col_colors,
+        xticklabels=show_labels,
+        yticklabels=show_labels,
+        figsize=figsize
+    )
+    grid.fig.suptitle("Sample-sample correlation", fontsize=12)
+    return grid.fig
+
+
+def plot_enrichment_network(df: pd.DataFrame, figsize=(10, 10),
+                            gene_index: GeneIndex = None):
+    """
+    Строит сеть обогащения и возвращает фигуру
+
+    Args:
+        df: DataFrame с результатами обогащения
+        figsize: размер фигуры
+        gene_index: если передан, гены объединяются по каноническому символу
+    """
+    G = nx.Graph()
+
+    # Добавляем узлы для терминов и генов
+    for _, row in df.iterrows():
+        term = row['Term']
+        G.add_node(term, type='term', pvalue=row['P-value'])
+
+        genes = row['Genes']
+        if gene_index is not None:
+            genes = gene_index.canonical(genes)
+        for gene in genes:
+            G.add_node(gene, type='gene')
+            G.add_edge(term, gene)
+
+    # Раскраска узлов
+    term_nodes = [n for n, attrs in G.nodes(
+        data=True) if attrs['type'] == 'term']
+    gene_nodes = [n for n, attrs in G.nodes(
+        data=True) if attrs['type'] == 'gene']
+
+    # Позиционирование узлов
+    pos = nx.spring_layout(G, k=0.3, iterations=50)
+
+    # Создаем фигуру
+    fig, ax = plt.subplots(figsize=figsize)
+
+    # Рисуем термины (круги)
+    nx.draw_networkx_nodes(
+        G, pos,
+        nodelist=term_nodes,
+        node_color=[G.nodes[n]['pvalue'] for n in term_nodes],
+        node_size=800,
+        cmap=plt.cm.Reds,
+        alpha=0.8,
+        node_shape="s"
+    )
+
+    # Рисуем гены (квадраты)
+    nx.draw_networkx_nodes(
+        G, pos,
+        nodelist=gene_nodes,
+        node_color='skyblue',
+        node_size=400,
+        alpha=0.8,
+        node_shape="o"
+    )
+
+    # Рисуем ребра
+    nx.draw_networkx_edges(G, pos, width=1.0, alpha=0.2)
+
+    # Подписи узлов
+    nx.draw_networkx_labels(
+        G, pos,
+        labels={n: n for n in G.nodes()},
+        font_size=8,
+        font_family='sans-serif'
+    )
+
+    # Легенда и цветовая шкала
+    sm = plt.cm.ScalarMappable(
+        cmap=plt.cm.Reds,
+        norm=plt.Normalize(vmin=df['P-value'].min(), vmax=df['P-value'].max()))
+    sm.set_array([])
+    plt.colorbar(
+        sm,
+        ax=ax,  # Указываем конкретный Axes
+        label='P-value',
+        shrink=0.5,
+        location='right'
+    )
+
+    plt.title("Enrichment Network", fontsize=12)
+    plt.axis('off')
+    return fig
+
+
+def plot_volcano(results: pd.DataFrame, title: str, fc_threshold=1, p_value=0.05,
+                 top_genes=10, figsize=(8, 6)):
+    """
+    Строит статичный volcano plot (для экспорта в PNG/SVG) и возвращает фигуру
+
+    Значимые гены (|log2FC| ≥ fc_threshold и p < p_value) выделяются цветом,
+    top_genes самых значимых подписываются.
+    """
+    significant = (results['p_value'] < p_value) & \
+        (results['log2_fold_change'].abs() >= fc_threshold)
+    top_label = results[significant].sort_values('p_value').head(top_genes)
+
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.scatter(results.loc[~significant, 'log2_fold_change'],
+               results.loc[~significant, '-log10_pvalue'],
+               s=4, color='#36a2eb', alpha=0.6, rasterized=True)
+    ax.scatter(results.loc[significant, 'log2_fold_change'],
+               results.loc[significant, '-log10_pvalue'],
+               s=6, color='#ff6384', alpha=0.8, rasterized=True)
+    for _, row in top_label.iterrows():
+        ax.annotate(row['gene'], (row['log2_fold_change'], row['-log10_pvalue']),
+                    textcoords='offset points', xytext=(0, 4), ha='center', fontsize=7)
+
+    ax.axhline(-np.log10(p_value), linestyle='--', color='#ff6384', linewidth=0.8)
+    ax.axvline(fc_threshold, linestyle='--', color='#4bc0c0', linewidth=0.8)
+    ax.axvline(-fc_threshold, linestyle='--', color='#4bc0c0', linewidth=0.8)
+    ax.set_xlabel('log2(Fold Change)')
+    ax.set_ylabel('-log10(p-value)')
+    ax.set_title(title)
+    return fig
+
+
+def plot_group_heatmap(mean_expr: pd.DataFrame, title: str, figsize=(4, 40)):
+    """Тепловая карта средней экспрессии генов (строки) по группам (столбцы)"""
+    plt.rcParams.update({'font.size': 6})
+    fig = plt.figure(figsize=figsize)
+    sns.heatmap(mean_expr, annot=True, fmt='.2f', linewidths=0.5, cmap='plasma')
+    plt.title(title)
+    plt.xlabel('Группа')
+    plt.ylabel('Ген')
+    return fig
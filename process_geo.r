@@ -53,7 +53,11 @@ if (!dir.exists(dir_path)) {
 expr_path <- file.path(dir_path, paste0(name, "_expr.csv"))
 phen_path <- file.path(dir_path, paste0(name, "_phen.csv"))
 
-write.csv(expression_df, expr_path)
-write.csv(pData(gse), phen_path)
+# Files are written under temporary names and renamed when complete, so the
+# app never reads a half-written CSV; the expression file is renamed last
+write.csv(expression_df, paste0(expr_path, ".tmp"))
+write.csv(pData(gse), paste0(phen_path, ".tmp"))
+file.rename(paste0(phen_path, ".tmp"), phen_path)
+file.rename(paste0(expr_path, ".tmp"), expr_path)
 
 cat(sprintf("Cleaned expression matrix saved to: %s\n", expr_path))
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from expression_store import MEMORY_BUDGET, ExpressionView, columns_per_block
+
+CORRELATION_METHODS = ('pearson', 'spearman')
+
+
+def _standardize_block(block: np.ndarray, method: str) -> np.ndarray:
+    """Центрирует и нормирует столбцы блока, чтобы Z.T @ Z давало корреляции"""
+    if method == 'spearman':
+        from scipy.stats import rankdata
+        block = rankdata(block, axis=0)
+    block = np.asarray(block, dtype=np.float32)
+    block = block - block.mean(axis=0, dtype=np.float64).astype(np.float32)
+    norms = np.linalg.norm(block, axis=0)
+    # Образцы с постоянной экспрессией не коррелируют ни с чем
+    norms[norms == 0] = np.nan
+    return block / norms
+
+
+def correlation_matrix(expr: ExpressionView, method: str = 'pearson',
+                       block_size: int = None,
+                       memory_budget: int = MEMORY_BUDGET) -> pd.DataFrame:
+    """
+    Считает матрицу корреляций образец×образец блоками по столбцам
+
+    Каждый блок образцов читается из хранилища и стандартизуется (для
+    Spearman — ранжируется) один раз. Стандартизованная матрица хранится
+    по образцам: в памяти, если помещается в memory_budget, иначе во
+    временном файле рядом с хранилищем, так что пары блоков читаются
+    последовательно, без повторных проходов по построчному хранилищу.
+
+    Args:
+        expr: представление хранилища экспрессии (гены × образцы)
+        method: 'pearson' или 'spearman'
+        block_size: число образцов в одном блоке; по умолчанию из memory_budget
+            (два блока float32 одновременно)
+    """
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"Unknown correlation method: {method}")
+
+    # Гены с пропусками исключаются, чтобы все пары считались по одним генам
+    valid_rows = np.concatenate(
+        [~np.isnan(block).any(axis=1) for _, _, block in expr.iter_row_chunks()])
+    n_genes, n_samples = expr.shape
+    n_valid = int(valid_rows.sum())
+    block_size = block_size or columns_per_block(n_genes, 4, memory_budget // 2)
+    starts = range(0, n_samples, block_size)
+    corr = np.empty((n_samples, n_samples), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory(dir=expr.store.directory) as tmp:
+        if n_valid * n_samples * 4 <= memory_budget:
+            standardized = np.empty((n_samples, n_valid), dtype=np.float32)
+        else:
+            standardized = np.lib.format.open_memmap(
+                os.path.join(tmp, 'standardized.npy'), mode='w+',
+                dtype=np.float32, shape=(n_samples, n_valid))
+        for start in starts:
+            stop = min(start + block_size, n_samples)
+            block = expr.column_block(start, stop)[valid_rows]
+            standardized[start:stop] = _standardize_block(block, method).T
+
+        for i in starts:
+            i_stop = min(i + block_size, n_samples)
+            block_i = np.asarray(standardized[i:i_stop])
+            for j in starts:
+                if j < i:
+                    continue
+                j_stop = min(j + block_size, n_samples)
+                block_j = block_i if j == i else np.asarray(standardized[j:j_stop])
+                product = block_i @ block_j.T
+                corr[i:i_stop, j:j_stop] = product
+                corr[j:j_stop, i:i_stop] = product.T
+        del standardized
+
+    np.clip(corr, -1, 1, out=corr)
+    return pd.DataFrame(corr, index=expr.columns, columns=expr.columns)
+
+
+def detect_outliers(corr_df: pd.DataFrame, threshold: float = 3.0) -> pd.DataFrame:
+    """
+    Помечает образцы-выбросы по медианной корреляции с остальными образцами
+
+    Образец считается выбросом, если его медианная корреляция ниже медианы
+    по всем образцам более чем на threshold робастных стандартных отклонений
+    (MAD × 1.4826).
+    """
+    values = corr_df.to_numpy(dtype=np.float64, copy=True)
+    np.fill_diagonal(values, np.nan)
+    median_corr = np.nanmedian(values, axis=1)
+
+    center = np.nanmedian(median_corr)
+    mad = np.nanmedian(np.abs(median_corr - center)) * 1.4826
+    if not mad:
+        robust_z = np.zeros_like(median_corr)
+    else:
+        robust_z = (median_corr - center) / mad
+
+    return pd.DataFrame({
+        'median_correlation': median_corr,
+        'robust_z': robust_z,
+        'is_outlier': robust_z < -threshold
+    }, index=corr_df.index).rename_axis('sample')
@@ -0,0 +1,332 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class Job:
+    """Задача планировщика и её состояние"""
+
+    def __init__(self, user: str, kind: str, key, fn, args: tuple, kwargs: dict):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.kind = kind
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        # Сессии, ожидающие результат (задача с ключом может быть общей)
+        self.subscribers = set()
+        self.status = QUEUED
+        self.future = None
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class BatchExecutor:
+    """
+    Исполнитель вложенных батчей задачи пользователя (см. JobScheduler.submit_batch)
+
+    Передаётся в функции, которые ждут объект с методом submit
+    (concurrent.futures.Executor), например preranked_gsea или write_bundle.
+    """
+
+    def __init__(self, scheduler: 'JobScheduler', user: str):
+        self.scheduler = scheduler
+        self.user = user
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self.scheduler.submit_batch(self.user, fn, *args, **kwargs)
+
+
+class JobScheduler:
+    """
+    Общий для всех сессий планировщик тяжёлых задач
+
+    CPU-задачи выполняются в пуле процессов (не конкурируют за GIL со скриптами
+    Streamlit), I/O-задачи — в пуле потоков. Для каждого пользователя
+    ограничено число одновременно выполняемых задач, остальные ждут в очереди.
+    Задачи с одинаковым ключом, пока они не завершены, выполняются один раз:
+    каждая сессия становится подписчиком общей задачи, задача отменяется, только
+    когда от неё отписались все, и удаляется, когда результат прочитали все.
+    Вложенные батчи задач (submit_batch) ограничены тем же лимитом на пользователя.
+    """
+
+    def __init__(self, cpu_workers: int = None, io_workers: int = 8,
+                 per_user_limit: int = 2, result_ttl: float = 3600):
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.per_user_limit = per_user_limit
+        self.result_ttl = result_ttl
+        self._pools = {
+            # spawn: fork многопоточного сервера Streamlit небезопасен
+            'cpu': ProcessPoolExecutor(
+                max_workers=self.cpu_workers, mp_context=multiprocessing.get_context('spawn')),
+            'io': ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='dge-io')
+        }
+        self._lock = threading.RLock()
+        self._jobs = {}
+        self._in_flight = {}
+        self._queues = {}
+        self._running = {}
+        self._batch_queues = {}
+        self._batch_running = {}
+
+    def submit(self, user: str, fn, *args, kind: str = 'cpu', key=None,
+               subscriber: str = None, **kwargs) -> str:
+        """
+        Ставит задачу в очередь и возвращает её id
+
+        Args:
+            user: идентификатор пользователя для лимита одновременных задач
+            kind: 'cpu' — пул процессов (fn и аргументы должны сериализоваться),
+                'io' — пул потоков
+            key: ключ дедупликации; если задача с таким ключом ещё выполняется,
+                возвращается её id
+            subscriber: кто ждёт результат; по умолчанию текущая сессия Streamlit
+        """
+        if kind not in self._pools:
+            raise ValueError(f"Unknown job kind: {kind}")
+        subscriber = subscriber if subscriber is not None else current_session()
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._in_flight:
+                job_id = self._in_flight[key]
+                self._jobs[job_id].subscribers.add(subscriber)
+                return job_id
+            job = Job(user, kind, key, fn, args, kwargs)
+            job.subscribers.add(subscriber)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._in_flight[key] = job.id
+            self._queues.setdefault(user, deque()).append(job.id)
+            self._dispatch(user)
+            return job.id
+
+    def submit_batch(self, user: str, fn, *args, **kwargs) -> Future:
+        """
+        Отправляет батч задачи (например, перестановки GSEA) в пул процессов
+
+        Батчи пользователя занимают не больше per_user_limit процессов пула
+        одновременно, остальные ждут в очереди пользователя, поэтому одна
+        задача не забирает весь пул. Не блокирует: возвращает Future, который
+        завершится вместе с батчем.
+        """
+        future = Future()
+        with self._lock:
+            self._batch_queues.setdefault(user, deque()).append((future, fn, args, kwargs))
+            self._dispatch_batches(user)
+        return future
+
+    def batch_executor(self, user: str) -> BatchExecutor:
+        """Исполнитель с методом submit, отправляющий батчи через submit_batch"""
+        return BatchExecutor(self, user)
+
+    def warm_up(self, fn, *args, workers: int = 2) -> list:
+        """
+        Запускает не более workers процессов пула заранее и выполняет в каждом fn
+
+        Используется для импорта тяжёлых библиотек до первой настоящей задачи.
+        Остальные процессы пул запускает по мере появления задач, поэтому на
+        большом сервере прогрев не занимает десятки процессов и гигабайты памяти.
+        """
+        pool = self._pools['cpu']
+        return [pool.submit(fn, *args) for _ in range(min(self.cpu_workers, workers))]
+
+    def status(self, job_id: str):
+        """Статус задачи или None, если задача неизвестна (удалена или сервер перезапущен)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.status if job else None
+
+    def result(self, job_id: str, subscriber: str = None):
+        """
+        Результат завершённой задачи; исключение задачи пробрасывается
+
+        Прочитавший подписчик отписывается; когда результат прочитали все,
+        задача удаляется, не дожидаясь result_ttl.
+        """
+        subscriber = subscriber if subscriber is not None else current_session()
+        with self._lock:
+            job = self._jobs[job_id]
+            if job.status not in ACTIVE_STATUSES:
+                job.subscribers.discard(subscriber)
+                if not job.subscribers:
+                    del self._jobs[job_id]
+        if job.status == FAILED:
+            raise job.error
+        if job.status != DONE:
+            raise RuntimeError(f"Job {job_id} is {job.status}")
+        return job.result
+
+    def cancel(self, job_id: str, subscriber: str = None):
+        """
+        Отписывает subscriber (по умолчанию текущую сессию) от задачи
+
+        Задача отменяется, только если других подписчиков не осталось. Задача
+        в очереди снимается сразу; уже выполняющаяся помечается отменённой,
+        её результат будет отброшен.
+        """
+        subscriber = subscriber if subscriber is not None else current_session()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return
+            job.subscribers.discard(subscriber)
+            if job.subscribers:
+                return
+            if job.status == QUEUED:
+                self._queues[job.user].remove(job.id)
+            elif job.future.cancel():
+                # Пул ещё не начал задачу: _on_done освободит слот пользователя
+                return
+            job.status = CANCELLED
+            job.finished_at = time.monotonic()
+            self._release_key(job)
+
+    def _dispatch(self, user: str):
+        queue = self._queues.get(user)
+        while queue and self._running.get(user, 0) < self.per_user_limit:
+            job = self._jobs[queue.popleft()]
+            job.status = RUNNING
+            self._running[user] = self._running.get(user, 0) + 1
+            job.future = self._pools[job.kind].submit(job.fn, *job.args, **job.kwargs)
+            job.future.add_done_callback(
+                lambda future, job_id=job.id: self._on_done(job_id))
+
+    def _dispatch_batches(self, user: str):
+        queue = self._batch_queues.get(user)
+        while queue and self._batch_running.get(user, 0) < self.per_user_limit:
+            future, fn, args, kwargs = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._batch_running[user] = self._batch_running.get(user, 0) + 1
+            self._pools['cpu'].submit(fn, *args, **kwargs).add_done_callback(
+                lambda inner, future=future: self._on_batch_done(user, future, inner))
+
+    def _on_batch_done(self, user: str, future: Future, inner: Future):
+        with self._lock:
+            self._batch_running[user] -= 1
+            self._dispatch_batches(user)
+        # Результат передаётся вне блокировки: колбэки ожидающих не держат планировщик
+        if inner.cancelled():
+            future.set_exception(CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+
+    def _on_done(self, job_id: str):
+        with self._lock:
+            job = self._jobs[job_id]
+            future = job.future
+            if job.status == RUNNING:
+                if future.cancelled():
+                    job.status = CANCELLED
+                elif future.exception() is not None:
+                    job.status = FAILED
+                    job.error = future.exception()
+                else:
+                    job.status = DONE
+                    job.result = future.result()
+                job.finished_at = time.monotonic()
+            # Данные задачи больше не нужны, освобождаем память
+            job.fn = job.args = job.kwargs = None
+            self._release_key(job)
+            self._running[job.user] -= 1
+            self._dispatch(job.user)
+
+    def _release_key(self, job: Job):
+        if job.key is not None and self._in_flight.get(job.key) == job.id:
+            del self._in_flight[job.key]
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.result_ttl
+                   and job.status not in ACTIVE_STATUSES]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+@st.cache_resource
+def get_scheduler() -> JobScheduler:
+    """Один планировщик на процесс сервера"""
+    return JobScheduler()
+
+
+def current_session() -> str:
+    """Идентификатор текущей сессии (вкладки) Streamlit"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else 'default'
+
+
+def current_user() -> str:
+    """
+    Пользователь для лимита одновременных задач
+
+    Вошедший пользователь (st.user), иначе браузер (XSRF cookie Streamlit
+    общая для всех вкладок), чтобы вкладки одного пользователя делили лимит;
+    без них — сессия.
+    """
+    try:
+        email = st.user.get('email')
+        if email:
+            return email
+    except Exception:
+        # st.user недоступен без настроенной авторизации или в старых версиях
+        pass
+    try:
+        browser = st.context.cookies.get('_streamlit_xsrf')
+    except AttributeError:
+        browser = None
+    return f"browser:{browser}" if browser else current_session()
+
+
+def poll_job(state_key: str, message: str, cancellable: bool = True,
+             poll_interval: float = 1.0):
+    """
+    Опрашивает задачу, id которой лежит в st.session_state[state_key]
+
+    Пока задача выполняется, показывает статус и перезапускает скрипт через
+    poll_interval секунд. Возвращает результат завершённой задачи (один раз:
+    id удаляется из session_state, сессия отписывается от задачи) или None.
+    Ошибка задачи пробрасывается.
+    """
+    job_id = st.session_state.get(state_key)
+    if job_id is None:
+        return None
+
+    scheduler = get_scheduler()
+    status = scheduler.status(job_id)
+    if status in ACTIVE_STATUSES:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.info(f"{message} ({status})")
+        with col2:
+            if cancellable and st.button("Отменить", key=f"cancel_{state_key}"):
+                scheduler.cancel(job_id)
+                del st.session_state[state_key]
+                st.rerun()
+        time.sleep(poll_interval)
+        st.rerun()
+
+    del st.session_state[state_key]
+    if status == CANCELLED:
+        st.warning("Задача отменена")
+        return None
+    if status is None:
+        return None
+    return scheduler.result(job_id)
@@ -0,0 +1,232 @@
+import gzip
+import os
+import re
+import numpy as np
+import pandas as pd
+from expression_store import ExpressionStore, staging_name
+
+SECTION_KINDS = ('DATABASE', 'SERIES', 'PLATFORM', 'SAMPLE')
+SYMBOL_PATTERN = re.compile(r'gene.*symbol', re.IGNORECASE)
+
+
+class SoftSection:
+    """
+    Секция SOFT файла (^SERIES, ^PLATFORM, ^SAMPLE)
+
+    attributes — словарь "!Ключ" → список значений. Таблица секции хранится
+    только в виде выбранных колонок (table_columns), остальные не разбираются.
+    """
+
+    def __init__(self, kind: str, accession: str):
+        self.kind = kind
+        self.accession = accession
+        self.attributes = {}
+        self.table = None
+
+    def get(self, key: str, default=None):
+        values = self.attributes.get(key)
+        return values[0] if values else default
+
+
+def _open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def _parse_assignment(line: str) -> tuple:
+    key, _, value = line.partition('=')
+    return key.strip(), value.strip()
+
+
+def _read_table(lines, header: str, table_columns) -> pd.DataFrame:
+    """Читает строки таблицы до !..._table_end, оставляя только нужные колонки"""
+    names = header.rstrip('\n').split('\t')
+    if table_columns is None:
+        positions = list(range(len(names)))
+    elif callable(table_columns):
+        positions = table_columns(names)
+    else:
+        positions = [names.index(col) for col in table_columns if col in names]
+
+    columns = [[] for _ in positions]
+    for line in lines:
+        if line.startswith('!') and line.rstrip().endswith('_table_end'):
+            break
+        fields = line.rstrip('\n').split('\t')
+        for column, position in zip(columns, positions):
+            column.append(fields[position] if position < len(fields) else '')
+    return pd.DataFrame({names[position]: column for position, column in zip(positions, columns)})
+
+
+def _skip_table(lines):
+    for line in lines:
+        if line.startswith('!') and line.rstrip().endswith('_table_end'):
+            break
+
+
+def iter_sections(path: str, sections=SECTION_KINDS, table_columns=None,
+                  section_filter=None):
+    """
+    Потоково читает SOFT файл (.soft или .soft.gz) и выдаёт секции по одной
+
+    Секции, которых нет в sections, пропускаются без разбора и без хранения
+    строк. table_columns — словарь вид секции → список колонок таблицы или
+    функция (имена колонок → позиции); None — таблицы этой секции не читаются.
+    section_filter(section) вызывается перед таблицей, когда атрибуты секции
+    уже прочитаны; если он вернул False, таблица пропускается без разбора.
+    """
+    table_columns = table_columns or {}
+    with _open_text(path) as lines:
+        section = None
+        for line in lines:
+            if line.startswith('^'):
+                if section is not None:
+                    yield section
+                kind, accession = _parse_assignment(line[1:])
+                section = SoftSection(kind.upper(), accession) \
+                    if kind.upper() in sections else None
+            elif section is None:
+                continue
+            elif line.startswith('!') and line.rstrip().endswith('_table_begin'):
+                header = next(lines, '')
+                if section.kind in table_columns and \
+                        (section_filter is None or section_filter(section)):
+                    section.table = _read_table(lines, header, table_columns[section.kind])
+                else:
+                    _skip_table(lines)
+            elif line.startswith('!'):
+                key, value = _parse_assignment(line[1:])
+                section.attributes.setdefault(key, []).append(value)
+        if section is not None:
+            yield section
+
+
+def _platform_columns(names: list) -> list:
+    """Позиции колонок ID и символа гена в таблице платформы"""
+    symbol_cols = [name for name in names if SYMBOL_PATTERN.search(name)]
+    if not symbol_cols:
+        raise ValueError("No 'Gene Symbol' column found in the platform annotations.")
+    return [names.index('ID'), names.index(symbol_cols[0])]
+
+
+def _gene_mapping(platform_table: pd.DataFrame) -> pd.Series:
+    """
+    Соответствие probe ID → символ гена, как в process_geo.r
+
+    Отбрасываются неоднозначные (///) и пустые символы; для каждого гена
+    остаётся первый probe.
+    """
+    probes, symbols = platform_table.iloc[:, 0], platform_table.iloc[:, 1].str.strip()
+    keep = (symbols != '') & ~symbols.str.contains('///', regex=False)
+    mapping = pd.Series(symbols[keep].to_numpy(), index=probes[keep].to_numpy())
+    return mapping[~mapping.duplicated()]
+
+
+def _phenotype_row(sample: SoftSection) -> dict:
+    """Атрибуты образца в виде строки pData: повторяющиеся ключи → key, key.1, ..."""
+    row = {}
+    for key, values in sample.attributes.items():
+        name = key[len('Sample_'):] if key.startswith('Sample_') else key
+        for i, value in enumerate(values):
+            row[name if i == 0 else f"{name}.{i}"] = value
+    return row
+
+
+def soft_to_store(path: str, directory: str, name: str, platform: str = None,
+                  column_buffer: int = 64) -> ExpressionStore:
+    """
+    Загружает SOFT family файл в хранилище экспрессии и таблицу фенотипов
+
+    Матрица собирается по столбцам (образцам): значения накапливаются в буфере
+    из column_buffer столбцов и записываются в memmap блоком, поэтому память
+    не зависит от числа образцов. Фенотипы сохраняются в {name}_phen.csv
+    в формате pData. Всё собирается под временными именами; фенотипы
+    переименовываются первыми, хранилище публикуется последним, поэтому
+    ExpressionStore.exists(name) означает, что готовы оба.
+
+    Args:
+        platform: GPL платформы; по умолчанию первая платформа в файле
+    """
+    os.makedirs(directory, exist_ok=True)
+    series_samples = pd.Index([])
+    store = None
+
+    def wanted(section):
+        # Таблицы образцов других платформ и не из серии не разбираются
+        if section.kind == 'PLATFORM':
+            return store is None and platform in (None, section.accession)
+        return store is not None and section.get('Sample_platform_id') == platform and \
+            section.accession in series_samples
+
+    sections = iter_sections(path, table_columns={
+        'PLATFORM': _platform_columns,
+        'SAMPLE': ['ID_REF', 'VALUE']
+    }, section_filter=wanted)
+    staging = source = staging_name(name)
+
+    filled = []
+    phenotypes = {}
+    buffer = None
+    buffer_columns = []
+
+    def flush_buffer():
+        store.values[:, buffer_columns] = buffer[:, :len(buffer_columns)]
+        buffer_columns.clear()
+
+    try:
+        for section in sections:
+            if section.kind == 'SERIES':
+                series_samples = pd.Index(section.attributes.get('Series_sample_id', []))
+            elif section.kind == 'PLATFORM' and store is None and \
+                    platform in (None, section.accession):
+                platform = section.accession
+                mapping = _gene_mapping(section.table)
+                store = ExpressionStore.create(
+                    directory, staging, mapping.to_numpy(), series_samples)
+                probes = pd.Index(mapping.index)
+                buffer = np.empty((len(probes), column_buffer), dtype=np.float32)
+            elif section.kind == 'SAMPLE' and store is not None and \
+                    section.get('Sample_platform_id') == platform and section.table is not None:
+                position = series_samples.get_indexer([section.accession])[0]
+                if position < 0:
+                    continue
+                table = section.table
+                rows = probes.get_indexer(table['ID_REF'])
+                found = rows >= 0
+                column = buffer[:, len(buffer_columns)]
+                column[:] = np.nan
+                column[rows[found]] = pd.to_numeric(
+                    table['VALUE'][found], errors='coerce').to_numpy(dtype=np.float32)
+
+                buffer_columns.append(position)
+                filled.append(position)
+                phenotypes[section.accession] = _phenotype_row(section)
+                if len(buffer_columns) == column_buffer:
+                    flush_buffer()
+
+        if store is None:
+            raise ValueError(f"Platform {platform} not found in {path}" if platform
+                             else f"No platform section found in {path}")
+        if buffer_columns:
+            flush_buffer()
+        store.values.flush()
+
+        # Образцы других платформ и отсутствующие в файле в хранилище не попадают
+        if len(filled) != len(series_samples):
+            source, staging = staging, staging_name(name)
+            store.copy_to(directory, staging, columns=np.sort(filled))
+            del store
+            ExpressionStore.discard(directory, source)
+        else:
+            del store
+        samples = series_samples[np.sort(filled)]
+
+        phen_path = os.path.join(directory, f"{name}_phen.csv")
+        pd.DataFrame.from_dict(phenotypes, orient='index').loc[samples].to_csv(f"{phen_path}.tmp")
+        os.replace(f"{phen_path}.tmp", phen_path)
+    except BaseException:
+        for leftover in {source, staging}:
+            ExpressionStore.discard(directory, leftover)
+        raise
+    return ExpressionStore.publish(directory, staging, name)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from phenotype import PhenotypeTable, parse_characteristics
+
+
+def make_phenotypes():
+    return pd.DataFrame({
+        'title': ['s1', 's2', 's3'],
+        'characteristics_ch1': ['tissue: liver', 'tissue: lung', 'tissue: liver'],
+        'characteristics_ch1.1': ['tumor', 'normal', np.nan],
+        'characteristics_ch1.2': ['age: 50', 'treated', 'age: 61'],
+    }, index=pd.Index(['GSM1', 'GSM2', 'GSM3'], name='id'))
+
+
+def test_parsed_columns_are_replaced():
+    result = parse_characteristics(make_phenotypes())
+    assert 'characteristics_ch1' not in result
+    assert result['tissue:ch1'].tolist() == ['liver', 'lung', 'liver']
+
+
+def test_keyless_column_is_kept():
+    result = parse_characteristics(make_phenotypes())
+    assert result['characteristics_ch1.1'].tolist()[:2] == ['tumor', 'normal']
+    assert pd.isna(result.loc['GSM3', 'characteristics_ch1.1'])
+
+
+def test_mixed_column_is_kept_and_parsed():
+    result = parse_characteristics(make_phenotypes())
+    assert result['characteristics_ch1.2'].tolist() == ['age: 50', 'treated', 'age: 61']
+    assert result.loc[['GSM1', 'GSM3'], 'age:ch1'].tolist() == ['50', '61']
+    assert pd.isna(result.loc['GSM2', 'age:ch1'])
+
+
+def test_keyless_values_are_groupable():
+    table = PhenotypeTable(make_phenotypes())
+    assert table.data['characteristics_ch1.1'].dtype == 'category'
+    assert set(table.data['characteristics_ch1.1'].dropna()) == {'tumor', 'normal'}
@@ -0,0 +1,37 @@
+import importlib
+import os
+import threading
+import streamlit as st
+from scheduler import get_scheduler
+
+# Библиотеки, которые страницы импортируют лениво
+PAGE_MODULES = ('scipy.stats', 'matplotlib.pyplot', 'seaborn', 'plotly.express',
+                'networkx', 'plots')
+# Модуль задач пула процессов (сам импортирует scipy.stats)
+WORKER_MODULE = 'de_analysis'
+# Сколько процессов пула запускать заранее
+WARM_WORKERS = 2
+
+
+def import_modules(modules):
+    for module in modules:
+        importlib.import_module(module)
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """
+    Один раз на процесс сервера прогревает тяжёлые импорты
+
+    Страницы импортируют тяжёлые библиотеки лениво; фоновый поток загружает их
+    в sys.modules заранее, а WARM_WORKERS процессов пула планировщика
+    запускаются и импортируют модули задач до первого расчёта. Отключается
+    переменной окружения DGE_NO_WARMUP (например, для замеров холодной загрузки).
+    """
+    if os.environ.get('DGE_NO_WARMUP'):
+        return None
+    thread = threading.Thread(target=import_modules, args=(PAGE_MODULES,),
+                              name='dge-warmup', daemon=True)
+    thread.start()
+    get_scheduler().warm_up(importlib.import_module, WORKER_MODULE, workers=WARM_WORKERS)
+    return thread